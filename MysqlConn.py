@@ -1,21 +1,175 @@
+import itertools
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
 import pymysql
 
+import metrics
+from query_cache import QueryCache
+
+
+@dataclass
+class WriteResult:
+    """
+    Outcome of a bulk write: affected rows and batches that were committed, and (batch index, message) errors.
+    A failed atomic write commits nothing, so both counts are 0.
+    """
+    rowcount: int = 0
+    batches: int = 0
+    errors: list = field(default_factory=list)
+
+    def __bool__(self):
+        return not self.errors
+
 
 class MysqlConn:
-    def __init__(self, host: str, port: int | str, user: str, password: str, database: str):
-        self.conn = None
-        self.cursor = None
+    def __init__(self, host: str, port: int | str, user: str, password: str, database: str,
+                 pool_size: int = 4, pool_timeout: float = 30, max_idle: float = 300,
+                 query_cache: QueryCache = None):
+        """
+        MySQL client backed by a small, thread-safe connection pool.
+
+        :param pool_size: maximum number of connections opened at the same time
+        :param pool_timeout: seconds to wait for a free connection before giving up
+        :param max_idle: connections idle for longer than this (seconds) are closed instead of reused
+        :param query_cache: result cache used by fetch_one / fetch_all calls that pass a ttl or version
+        """
         self.__host = host
         self.__port = int(port)
         self.__user = user
         self.__password = password
         self.__database = database
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.max_idle = max_idle
+        self.query_cache = query_cache
+
+        self.__lock = threading.Condition()
+        self.__idle = []  # [(connection, last_used), ...], most recently used last
+        self.__opened = 0
+        self.__stats = {"hits": 0, "misses": 0, "waits": 0, "wait_time": 0.0, "evictions": 0, "broken": 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _new_connection(self):
+        return pymysql.connect(host=self.__host, port=self.__port, user=self.__user, password=self.__password,
+                               database=self.__database, charset="utf8")
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def acquire(self):
+        """
+        Take a connection out of the pool, opening a new one if the pool is not full yet.
+        Idle connections are pinged before reuse; stale or broken ones are replaced.
+        """
+        deadline = time.monotonic() + self.pool_timeout
+        waited = None
+        with self.__lock:
+            while True:
+                now = time.monotonic()
+                while self.__idle:
+                    conn, last_used = self.__idle.pop()
+                    if now - last_used > self.max_idle:
+                        self.__opened -= 1
+                        self.__stats["evictions"] += 1
+                        self._discard(conn)
+                        continue
+                    break
+                else:
+                    conn = None
+                if conn is not None or self.__opened < self.pool_size:
+                    if conn is None:
+                        self.__opened += 1
+                    break
+                if waited is None:
+                    waited = now
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise TimeoutError("No free MySQL connection within %s seconds" % self.pool_timeout)
+                self.__lock.wait(remaining)
+            if waited is not None:
+                self.__stats["waits"] += 1
+                self.__stats["wait_time"] += time.monotonic() - waited
+
+        if conn is not None:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                self._discard(conn)
+                conn = None
+                with self.__lock:
+                    self.__stats["broken"] += 1
+            else:
+                with self.__lock:
+                    self.__stats["hits"] += 1
+                return conn
+
+        try:
+            conn = self._new_connection()
+        except Exception:
+            with self.__lock:
+                self.__opened -= 1
+                self.__lock.notify()
+            raise
+        with self.__lock:
+            self.__stats["misses"] += 1
+        return conn
+
+    def release(self, conn, broken: bool = False):
+        """ Return a connection to the pool; broken connections are closed """
+        with self.__lock:
+            if broken or not conn.open:
+                self.__opened -= 1
+                self._discard(conn)
+            else:
+                self.__idle.append((conn, time.monotonic()))
+            self.__lock.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a pooled connection for the duration of a with-block
+
+        with db.connection() as conn:
+            with conn.cursor() as cursor:
+                ...
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        except pymysql.err.OperationalError:
+            self.release(conn, broken=True)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def pool_stats(self) -> dict:
+        """ Pool counters: hits, misses, waits, total wait time (seconds), evictions, broken, opened and idle """
+        with self.__lock:
+            stats = dict(self.__stats)
+            stats["opened"] = self.__opened
+            stats["idle"] = len(self.__idle)
+        return stats
 
     def connect(self):
+        """ Warm up the pool with one connection; returns False if the database cannot be reached """
         try:
-            self.conn = pymysql.connect(host=self.__host, port=self.__port, user=self.__user, password=self.__password,
-                                        database=self.__database, charset="utf8")
-            self.cursor = self.conn.cursor()
+            with self.connection():
+                pass
         except Exception as e:
             print(e)
             return False
@@ -23,45 +177,317 @@ class MysqlConn:
             return True
 
     def close(self):
-        self.cursor.close()
-        self.conn.close()
+        """ Close all idle connections in the pool """
+        with self.__lock:
+            idle, self.__idle = self.__idle, []
+            self.__opened -= len(idle)
+            self.__lock.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    @staticmethod
+    def _record(operation: str, start: float, rows: int = None, failed: bool = False):
+        """ Report one statement's duration and row count to the metrics endpoint """
+        metrics.SQL_SECONDS.observe(time.perf_counter() - start, operation=operation)
+        if rows:
+            metrics.SQL_ROWS.inc(rows, operation=operation)
+        if failed:
+            metrics.SQL_ERRORS.inc(operation=operation)
 
     def execute(self, sql, params=None):
+        start = time.perf_counter()
         try:
-            self.connect()
-            self.cursor.execute(sql, params)
-            self.conn.commit()
+            with self.connection() as conn:
+                try:
+                    with conn.cursor() as cursor:
+                        rows = cursor.execute(sql, params)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
         except Exception as e:
+            self._record("execute", start, failed=True)
             print("SQL Execute error: " + str(e))
             print("Original SQL: " + sql)
-            self.conn.rollback()
             return False
         else:
+            self._record("execute", start, rows)
             return True
 
-    def fetch_one(self, sql):
+    @contextmanager
+    def transaction(self):
+        """
+        Run several statements in one transaction on one pooled connection.
+        Commits when the with-block ends, rolls back and re-raises if it raises.
+
+        with db.transaction() as cursor:
+            cursor.execute(...)
+            cursor.executemany(...)
+        """
+        start = time.perf_counter()
+        with self.connection() as conn:
+            try:
+                with conn.cursor() as cursor:
+                    yield cursor
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                self._record("transaction", start, failed=True)
+                raise
+        self._record("transaction", start)
+
+    def executemany(self, sql, rows, batch_size: int = 1000, atomic: bool = False) -> WriteResult:
+        """
+        Execute one statement for many parameter rows, batch_size rows per round trip.
+        pymysql rewrites INSERT ... VALUES statements into multi-row inserts for each batch.
+
+        :param rows: iterable of parameter rows, consumed one batch at a time
+        :param atomic: run all batches in one transaction and stop at the first error;
+            otherwise every batch is committed on its own and failed batches are skipped
+        """
+        start = time.perf_counter()
+        result = WriteResult()
+        rows = iter(rows)
+        # Batches are cut from the input as they are sent, so a generator of rows is never held in memory
+        batches = iter(lambda: list(itertools.islice(rows, batch_size)), [])
+        executed = 0
         try:
-            self.connect()
-            self.cursor.execute(sql)
-            result = self.cursor.fetchone()
-            self.close()
+            with self.connection() as conn:
+                with conn.cursor() as cursor:
+                    for index, batch in enumerate(batches):
+                        try:
+                            rowcount = cursor.executemany(sql, batch) or 0
+                            if atomic:
+                                executed += 1
+                            else:
+                                conn.commit()
+                                result.batches += 1
+                            result.rowcount += rowcount
+                        except Exception as e:
+                            conn.rollback()
+                            result.errors.append((index, str(e)))
+                            print("SQL executemany error in batch %d: %s" % (index, e))
+                            if atomic:
+                                result.rowcount = 0
+                                break
+                    else:
+                        if atomic:
+                            conn.commit()
+                            result.batches = executed
+        except Exception as e:
+            if atomic:
+                result.rowcount = 0
+            result.errors.append((None, str(e)))
+            print("SQL executemany error: " + str(e))
+            print("Original SQL: " + sql)
+        self._record("executemany", start, result.rowcount, failed=bool(result.errors))
+        return result
+
+    @staticmethod
+    def upsert_sql(table: str, columns: list, update_columns=None) -> str:
+        """
+        INSERT ... ON DUPLICATE KEY UPDATE statement for executemany
+
+        :param update_columns: columns overwritten on duplicate keys (default: all columns), or a dict of
+            column -> SQL expression, e.g. {"UploadCount": "UploadCount + VALUES(UploadCount)"}
+        """
+        if update_columns is None:
+            update_columns = columns
+        if not isinstance(update_columns, dict):
+            update_columns = {column: "VALUES(`%s`)" % column for column in update_columns}
+        return "INSERT INTO `%s` (%s) VALUES (%s) ON DUPLICATE KEY UPDATE %s" % (
+            table,
+            ", ".join("`%s`" % column for column in columns),
+            ", ".join(["%s"] * len(columns)),
+            ", ".join("`%s` = %s" % (column, expression) for column, expression in update_columns.items()))
+
+    def upsert(self, table: str, columns: list, rows, update_columns=None, batch_size: int = 1000,
+               atomic: bool = False) -> WriteResult:
+        """ Insert or update many rows with multi-row INSERT ... ON DUPLICATE KEY UPDATE; see upsert_sql """
+        return self.executemany(self.upsert_sql(table, columns, update_columns), rows, batch_size=batch_size,
+                                atomic=atomic)
+
+    def _fetch(self, operation: str, sql, params=None):
+        start = time.perf_counter()
+        try:
+            with self.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(sql, params)
+                    result = cursor.fetchone() if operation == "fetch_one" else cursor.fetchall()
+        except Exception:
+            self._record(operation, start, failed=True)
+            raise
+        if operation == "fetch_one":
+            self._record(operation, start, 0 if result is None else 1)
+        else:
+            self._record(operation, start, len(result))
+        return result
+
+    def _cached_fetch(self, operation: str, sql, params, ttl: float, version: str):
+        if self.query_cache is None or (ttl is None and version is None):
+            return self._fetch(operation, sql, params)
+        key = self.query_cache.key(operation, sql, params)
+        current = None
+        if version is not None:
+            try:
+                current = self.query_cache.probe(version, lambda probe: self._fetch("fetch_one", probe))
+            except Exception as e:
+                # Without a version the cached result cannot be validated, so read through
+                print("SQL version probe error: " + str(e))
+                return self._fetch(operation, sql, params)
+        cached = self.query_cache.get(key, ttl, current)
+        if cached is not None:
+            metrics.QUERY_CACHE_REQUESTS.inc(operation=operation, result=cached[0])
+            return cached[1]
+        metrics.QUERY_CACHE_REQUESTS.inc(operation=operation, result="miss")
+        result = self._fetch(operation, sql, params)
+        self.query_cache.put(key, result, current)
+        return result
+
+    def fetch_one(self, sql, params=None, ttl: float = None, version: str = None):
+        """
+        First row of a query, or None if there is none or the query failed
+
+        :param ttl: reuse a cached result up to this many seconds old (needs a query_cache)
+        :param version: SQL of a cheap version probe, e.g. "SELECT MAX(PrimaryId) FROM spiral_abysses";
+            a cached result is only reused while the probe returns the same row (needs a query_cache)
+        """
+        try:
+            return self._cached_fetch("fetch_one", sql, params, ttl, version)
         except Exception as e:
             print("SQL fetch error: " + str(e))
             print("Original SQL: " + sql)
-            result = None
-        if result is None:
             return None
-        else:
-            return result
 
-    def fetch_all(self, sql):
+    def fetch_all(self, sql, params=None, ttl: float = None, version: str = None):
+        """ All rows of a query, or () if it failed; see fetch_one for ttl and version """
         try:
-            self.connect()
-            self.cursor.execute(sql)
-            result = self.cursor.fetchall()
-            self.close()
+            return self._cached_fetch("fetch_all", sql, params, ttl, version)
         except Exception as e:
             print("SQL fetchall error: " + str(e))
             print("Original SQL: " + sql)
-            result = ()
-        return result
+            return ()
+
+    def key_range(self, from_clause: str, key: str):
+        """
+        (MIN(key), MAX(key)) of a table or join, or (None, None) if it is empty
+
+        :raises Exception: if the query fails, so a failed read is not mistaken for an empty table
+        """
+        result = self._fetch("fetch_one", "SELECT MIN(%s), MAX(%s) FROM %s" % (key, key, from_clause))
+        return result if result is not None else (None, None)
+
+    def fetch_keys(self, columns: str, from_clause: str, key: str, keys: list) -> tuple:
+        """
+        Rows of the given key values, as a chunk of fetch_chunks: the key followed by the selected columns
+
+        :raises Exception: if the query fails, like fetch_chunks
+        """
+        if not keys:
+            return ()
+        sql = "SELECT %s, %s FROM %s WHERE %s IN (%s)" % (key, columns, from_clause, key, ", ".join(["%s"] * len(keys)))
+        return self._fetch("fetch_keys", sql, list(keys))
+
+    def _iter_key_range(self, columns: str, from_clause: str, key: str, chunk_size: int, after, until):
+        sql = "SELECT %s, %s FROM %s WHERE %s > %%s" % (key, columns, from_clause, key)
+        if until is not None:
+            sql += " AND %s <= %%s" % key
+        sql += " ORDER BY %s LIMIT %%s" % key
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                while True:
+                    params = (after, chunk_size) if until is None else (after, until, chunk_size)
+                    start = time.perf_counter()
+                    cursor.execute(sql, params)
+                    rows = cursor.fetchall()
+                    self._record("fetch_chunk", start, len(rows))
+                    if not rows:
+                        return
+                    yield rows
+                    if len(rows) < chunk_size:
+                        return
+                    after = rows[-1][0]
+
+    def fetch_chunks(self, columns: str, from_clause: str, key: str, chunk_size: int = 100000,
+                     after=None, until=None, workers: int = 1):
+        """
+        Stream a (joined) table in fixed-size chunks using keyset pagination on an indexed, unique key column.
+        Each yielded chunk is a tuple of rows whose first column is the key, followed by the selected columns.
+
+        :param columns: column list to select, e.g. "Uid, UploadTime"
+        :param from_clause: table or join expression
+        :param key: unique, indexed column used for pagination, e.g. "spiral_abysses.PrimaryId"
+        :param chunk_size: number of rows per chunk
+        :param after: only return rows whose key is strictly greater than this value
+        :param until: only return rows whose key is less than or equal to this value
+        :param workers: when > 1, split the key range and read the parts in parallel over separate connections;
+            chunks are then yielded in completion order rather than key order
+        :raises Exception: the error of a failed read, after logging it, so a dropped connection does not look
+            like the end of the stream
+        """
+        sql = "SELECT %s FROM %s" % (columns, from_clause)
+        try:
+            if workers <= 1:
+                yield from self._iter_key_range(columns, from_clause, key, chunk_size,
+                                                after if after is not None else -1, until)
+                return
+
+            low, high = self.key_range(from_clause, key)
+            if low is None:
+                return
+            if after is not None:
+                low = max(low, after + 1)
+            if until is not None:
+                high = min(high, until)
+            if low > high:
+                return
+            step = (high - low) // workers + 1
+            bounds = [(low - 1 + i * step, min(low - 1 + (i + 1) * step, high)) for i in range(workers)
+                      if low - 1 + i * step < high]
+
+            chunks = queue.Queue(maxsize=workers * 2)
+            cancelled = threading.Event()
+            done = object()
+
+            def worker(bound_after, bound_until):
+                try:
+                    for rows in self._iter_key_range(columns, from_clause, key, chunk_size,
+                                                     bound_after, bound_until):
+                        while not cancelled.is_set():
+                            try:
+                                chunks.put(rows, timeout=1)
+                                break
+                            except queue.Full:
+                                continue
+                        if cancelled.is_set():
+                            return
+                except Exception as exc:
+                    chunks.put(exc)
+                finally:
+                    chunks.put(done)
+
+            threads = [threading.Thread(target=worker, args=bound, daemon=True) for bound in bounds]
+            for thread in threads:
+                thread.start()
+            try:
+                remaining = len(threads)
+                while remaining:
+                    item = chunks.get()
+                    if item is done:
+                        remaining -= 1
+                    elif isinstance(item, Exception):
+                        raise item
+                    else:
+                        yield item
+            finally:
+                cancelled.set()
+                while any(thread.is_alive() for thread in threads):
+                    try:
+                        chunks.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+        except Exception as e:
+            metrics.SQL_ERRORS.inc(operation="fetch_chunk")
+            print("SQL fetch_chunks error: " + str(e))
+            print("Original SQL: " + sql)
+            raise
@@ -1,16 +1,64 @@
-from dash import Dash, html, dash_table, dcc, callback, Output, Input
-import pandas as pd
-import plotly.graph_objects as go
-import matplotlib.colors as mcolors
-import numpy as np
-import requests
-import dash_bootstrap_components as dbc
-
-base_dict = requests.get("https://api.uigf.org/dict/genshin/all.json").json()
-id_to_name_dict = {}
-for lang, data in base_dict.items():
-    new_data = {v: k for k, v in data.items()}
-    id_to_name_dict[lang] = new_data
+import colorsys
+import hashlib
+import json
+import mimetypes
+import os
+import time
+from typing import TYPE_CHECKING
+import artifacts
+import metrics
+import static_export
+from data_refresher import DataRefresher, DataSnapshot
+from http_cache import HttpCache
+from homa import HomaStatistics, fetch_homa_statistics
+from shared_dataset import SharedDataset, SharedDatasetReader
+from utilization_history import UtilizationHistory
+
+# Dash, pandas, numpy and plotly are imported by the functions that use them, so the refresher and the web
+# workers start without loading the parts they never run
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+    from dash import Dash
+
+# Region index of the uploader reports, written by main.py
+UPLOADER_REGION_INDEX = "uploader_regions.json"
+
+# Seconds between two background refreshes of the Homa statistics
+REFRESH_INTERVAL = int(os.getenv('REFRESH_INTERVAL', 600))
+
+# Production serving: with more than one web worker, a single refresher process publishes the dataset
+# to SHARED_DATASET_DIR and every worker memory-maps it
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', 1))
+WEB_THREADS = int(os.getenv('WEB_THREADS', 4))
+WEB_PORT = int(os.getenv('WEB_PORT', 8050))
+SHARED_DATASET_DIR = os.getenv('SHARED_DATASET_DIR', 'cache/shared_dataset')
+# The worker and refresher processes share their metrics there, and /metrics of any worker serves their sum
+SHARED_METRICS_DIR = os.getenv('SHARED_METRICS_DIR', 'cache/metrics')
+shared_metrics = metrics.SharedMetrics(SHARED_METRICS_DIR) if WEB_WORKERS > 1 else None
+# /metrics port of the export-only mode, which has no web server of its own; 0 disables it
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9100))
+
+# Static export: every refreshed snapshot is also pre-rendered as JSON next to the report artifacts and served
+# by a plain file server through index.html; with WEB_WORKERS=0 only the refresher runs, without a web server
+STATIC_EXPORT = os.getenv('STATIC_EXPORT', '0') == '1' or WEB_WORKERS == 0
+
+# Upstream HTTP sources, cached on disk and revalidated with conditional requests
+UIGF_API_URL = os.getenv('UIGF_API_URL', 'https://api.uigf.org')
+HOMA_API_URL = os.getenv('HOMA_API_URL', 'https://homa.snapgenshin.com')
+HTTP_CACHE_DIR = os.getenv('HTTP_CACHE_DIR', 'cache/http')
+DICT_CACHE_TTL = int(os.getenv('DICT_CACHE_TTL', 60 * 60 * 24))
+HOMA_TIMEOUT = float(os.getenv('HOMA_TIMEOUT', 10))
+HOMA_RETRIES = int(os.getenv('HOMA_RETRIES', 2))
+http_cache = HttpCache(HTTP_CACHE_DIR)
+
+# Every fetched utilization snapshot, kept across schedules for the trend chart
+UTILIZATION_HISTORY_DIR = os.getenv('UTILIZATION_HISTORY_DIR', 'cache/utilization_history')
+TREND_SCHEDULES = int(os.getenv('TREND_SCHEDULES', 12))
+TREND_CHARACTERS = int(os.getenv('TREND_CHARACTERS', 5))
+utilization_history = UtilizationHistory(UTILIZATION_HISTORY_DIR)
+
+DICTIONARY_URL = UIGF_API_URL + "/dict/genshin/all.json"
 AVAILABLE_LANGUAGES = {
     "en": "English",
     "chs": "简体中文",
@@ -28,30 +76,461 @@ AVAILABLE_LANGUAGES = {
 }
 
 
-def make_current_utilization_rate_data() -> pd.DataFrame:
-    result = requests.get("https://homa.snapgenshin.com/Statistics/Avatar/UtilizationRate").json().get("data")
-    current_schedule = requests.get("https://homa.snapgenshin.com/Statistics/Overview").json() \
-        .get("data").get("scheduleId")
-    df_list = {}
-    for floor in result:
-        floor_number = str(floor["Floor"])
-        floor_data = [{"item": item["Item"], "Floor %s" % floor_number: item["Rate"],
-                       "schedule": current_schedule} for item in floor["Ranks"]]
-        for item_data in floor_data:
-            for this_lang in AVAILABLE_LANGUAGES.keys():
-                item_data[this_lang] = id_to_name_dict[this_lang].get(item_data["item"], "Traveler")
-
-        floor_data = sorted(floor_data, key=lambda x: x["item"], reverse=False)
-        for item_data in floor_data:
-            if item_data["item"] not in df_list.keys():
-                df_list[item_data["item"]] = item_data
-            else:
-                df_list[item_data["item"]]["Floor %s" % floor_number] = item_data["Floor %s" % floor_number]
-    return_df = pd.DataFrame(list(df_list.values()))
-    return_df = return_df[
-        ["schedule", "Floor 9", "Floor 10", "Floor 11", "Floor 12"] + list(AVAILABLE_LANGUAGES.keys())]
+def make_translation_table(dictionary: dict) -> "pd.DataFrame":
+    """ Item names indexed by item ID, one categorical column per language, from a {lang: {name: ID}} dictionary """
+    import pandas as pd
+
+    columns = {}
+    for lang in AVAILABLE_LANGUAGES.keys():
+        names = {item: name for name, item in dictionary.get(lang, {}).items() if isinstance(item, int)}
+        columns[lang] = pd.Series(names, dtype="category")
+    return pd.DataFrame(columns)
+
+
+# Names are joined to the ID-keyed utilization data only when a figure or table page is rendered; the
+# dictionary is loaded with the first dataset or name lookup
+base_dict = None
+translation_table = None
+# Incremented with every rebuild of translation_table
+dictionary_version = 0
+
+
+def update_translation_table(shared: bool = False):
+    """
+    Rebuild translation_table if the cached dictionary changed. Once it is older than DICT_CACHE_TTL the
+    dictionary is revalidated in the background, so a newly released character is named from the refresh
+    after that on.
+
+    :param shared: use the dictionary the refresher process stored in the shared HTTP cache directory
+        instead of revalidating it in this process
+    """
+    global base_dict, translation_table, dictionary_version
+    entry = http_cache.reload(DICTIONARY_URL) if shared else None
+    dictionary = entry["body"] if entry is not None else http_cache.get_json(DICTIONARY_URL, DICT_CACHE_TTL)
+    # The cache hands out the same body object until a changed response replaces it
+    if dictionary is not base_dict:
+        translation_table = make_translation_table(dictionary)
+        base_dict = dictionary
+        dictionary_version += 1
+
+
+def translate(items, language: str) -> "pd.Series":
+    """ Names of item IDs in a language, "Traveler" for IDs missing from the dictionary """
+    if translation_table is None:
+        update_translation_table()
+    return translation_table[language].reindex(items).astype(object).fillna("Traveler")
+
+
+DASHBOARD_TITLE = 'Spiral Abyss Live Report by Masterain'
+FLOORS = ["Floor 9", "Floor 10", "Floor 11", "Floor 12"]
+DEFAULT_LANGUAGE = 'chs'
+DEFAULT_NUM_BINS = 15
+TABLE_PAGE_SIZE = 15
+# Values reachable with the character count slider
+NUM_BINS_OPTIONS = [1, 15] + list(range(6, 51, 5))
+
+
+@metrics.staged("homa.fetch")
+def load_homa_statistics(cached_only: bool = False) -> HomaStatistics:
+    statistics = fetch_homa_statistics(HOMA_API_URL, http_cache, timeout=HOMA_TIMEOUT, retries=HOMA_RETRIES,
+                                       cached_only=cached_only)
+    for name, error in statistics.errors.items():
+        print("Homa %s: %s" % (name, error))
+    return statistics
+
+
+def normalize_ranks(groups: list, group_key: str = "Floor") -> "pd.DataFrame":
+    """
+    Long (group, item, rate) frame of a Homa ranking payload [{group_key: ..., "Ranks": [{"Item": ..., "Rate": ...}]}];
+    item IDs of any kind (characters, weapons) share the translation table
+    """
+    import numpy as np
+    import pandas as pd
+
+    counts = [len(group["Ranks"]) for group in groups]
+    total = sum(counts)
+    return pd.DataFrame({
+        "group": np.repeat([group[group_key] for group in groups], counts).astype("int16"),
+        "item": np.fromiter((rank["Item"] for group in groups for rank in group["Ranks"]), dtype="int32", count=total),
+        "rate": np.fromiter((rank["Rate"] for group in groups for rank in group["Ranks"]), dtype="float32",
+                            count=total),
+    })
+
+
+def load_utilization_data(cached_only: bool = False) -> "pd.DataFrame":
+    """ Loader of the refresher: the current utilization data, named with the current dictionary """
+    update_translation_table()
+    return make_current_utilization_rate_data(load_homa_statistics(cached_only=cached_only))
+
+
+def frame_digest(df: "pd.DataFrame") -> str:
+    """ Hash of the rows of a frame, index included """
+    import pandas as pd
+
+    return hashlib.sha1(pd.util.hash_pandas_object(df).to_numpy().tobytes()).hexdigest()
+
+
+def utilization_fingerprint(df: "pd.DataFrame") -> tuple:
+    """
+    Identity of a utilization dataset for the refresher: a hash of its rows and the version of the dictionary
+    naming them. An unchanged dataset is not published again, so no listener rebuilds its caches for it.
+    """
+    return frame_digest(df), dictionary_version
+
+
+@metrics.staged("utilization.frame")
+def make_current_utilization_rate_data(statistics: HomaStatistics) -> "pd.DataFrame":
+    """ One row per item ID: item, schedule and the usage rate on each floor (NaN if not used there) """
+    import numpy as np
+    import pandas as pd
+
+    result = statistics.utilization_rate
+    current_schedule = statistics.schedule_id
+    if result is None or current_schedule is None:
+        raise RuntimeError("Homa utilization rate or overview is unavailable")
+    ranks = normalize_ranks(result)
+    floor_numbers = np.array([int(floor.split(" ")[1]) for floor in FLOORS])
+    groups, ranked_items, ranked_rates = (ranks[c].to_numpy() for c in ("group", "item", "rate"))
+    on_floor = np.isin(groups, floor_numbers)
+    # Pivot in one step: every rank is scattered into its (item, floor) cell
+    items, rows = np.unique(ranked_items[on_floor], return_inverse=True)
+    rates = np.full((len(items), len(FLOORS)), np.nan, dtype="float32")
+    rates[rows, np.searchsorted(floor_numbers, groups[on_floor])] = ranked_rates[on_floor]
+    df = pd.DataFrame({"item": items, "schedule": np.full(len(items), current_schedule, dtype="int32"),
+                       **{floor: rates[:, i] for i, floor in enumerate(FLOORS)}})
     print("Successfully loaded data from Homa API")
-    return return_df
+    return df
+
+
+def rgb_to_hsv(rgb: tuple) -> tuple:
+    """ HSV of an RGB color with 0-1 components, computed like matplotlib.colors.rgb_to_hsv """
+    r, g, b = rgb
+    value = max(rgb)
+    delta = value - min(rgb)
+    saturation = delta / value if value > 0 else 0.0
+    if delta == 0:
+        return 0.0, saturation, value
+    if value == r:
+        hue = (g - b) / delta
+    elif value == g:
+        hue = 2.0 + (b - r) / delta
+    else:
+        hue = 4.0 + (r - g) / delta
+    return (hue / 6.0) % 1.0, saturation, value
+
+
+def hsv_gradient(start_rgb: tuple, end_rgb: tuple, steps: int) -> list:
+    """ steps "rgb(r, g, b)" colors from start_rgb to end_rgb (0-255 components), interpolated in HSV space """
+    start_hsv = rgb_to_hsv(tuple(c / 255 for c in start_rgb))
+    end_hsv = rgb_to_hsv(tuple(c / 255 for c in end_rgb))
+    colors = []
+    for i in range(steps):
+        hsv = tuple(a + i / (steps - 1) * (b - a) for a, b in zip(start_hsv, end_hsv)) if steps > 1 else start_hsv
+        colors.append('rgb' + str(tuple(int(c * 255) for c in colorsys.hsv_to_rgb(*hsv))))
+    return colors
+
+
+def make_utilization_figure(df: "pd.DataFrame", col_chosen: str, num_bins: int) -> dict:
+    """
+    Bar chart of the top num_bins characters of a floor. The x values are item IDs;
+    the browser maps them to names of the selected language.
+    """
+    import plotly.graph_objects as go
+
+    # Limit the dataframe to the top num_bins characters
+    limited_df = df.nlargest(num_bins, col_chosen)
+
+    colors = hsv_gradient((252, 163, 38), (89, 200, 228), num_bins)
+
+    text_values = [f'{val:.2%}' for val in limited_df[col_chosen]]
+
+    fig = go.Figure(data=[go.Bar(
+        x=limited_df["item"].astype(str),
+        y=limited_df[col_chosen],
+        marker_color=colors,  # use the color array here
+        marker_line_color='rgb(8,48,107)',
+        marker_line_width=1.5,
+        text=text_values,
+        textposition='outside',
+        hovertemplate="%{hovertext}: %{y:.2%}<extra></extra>"
+    )])
+
+    fig.update_layout(
+        yaxis_tickformat=".0%",
+        xaxis={'categoryorder': 'total descending'}
+    )
+
+    return fig.to_plotly_json()
+
+
+@metrics.staged("utilization.history")
+def record_history(snapshot: DataSnapshot):
+    """ Append a refreshed snapshot to the local utilization history """
+    try:
+        if utilization_history.append(snapshot.data, snapshot.loaded_at):
+            print("Stored utilization snapshot of schedule %s" % snapshot.data["schedule"].iloc[0])
+    except Exception as e:
+        print("Unable to store utilization history: " + str(e))
+
+
+def make_trend_figure(df: "pd.DataFrame", col_chosen: str) -> dict:
+    """
+    Usage rate across the stored schedules of the current top characters of a floor. The trace names are
+    item IDs; the browser maps them to names of the selected language.
+    """
+    import plotly.graph_objects as go
+
+    items = df.nlargest(TREND_CHARACTERS, col_chosen)["item"].tolist()
+    current_schedule = int(df["schedule"].iloc[0])
+    trend = utilization_history.trend(items, int(col_chosen.split(" ")[1]),
+                                      schedule_from=current_schedule - TREND_SCHEDULES + 1)
+    fig = go.Figure()
+    for item in items:
+        if item in trend.columns:
+            fig.add_trace(go.Scatter(x=trend.index.astype(str), y=trend[item], mode="lines+markers",
+                                     name=str(item)))
+    fig.update_layout(xaxis_title="Schedule", yaxis_title="Usage Rate", yaxis_tickformat=".0%",
+                      xaxis_type="category", legend_orientation="h")
+    return fig.to_plotly_json()
+
+
+def make_item_names(df: "pd.DataFrame") -> dict:
+    """ {language: {item ID: name}} for the clientside label switch """
+    ids = df["item"].astype(str).tolist()
+    return {lang: dict(zip(ids, translate(df["item"], lang))) for lang in AVAILABLE_LANGUAGES.keys()}
+
+
+class FigureCache:
+    """
+    Figures of one data snapshot built by make_figure(data, *key), e.g. the utilization figures keyed on
+    (floor, num_bins). The given keys are precomputed when a snapshot is published; other keys are memoized
+    on first use.
+    """
+
+    def __init__(self, make_figure, keys: list, stage: str):
+        """
+        :param make_figure: function of the snapshot data and the key arguments returning a figure dict
+        :param keys: argument tuples precomputed for every snapshot
+        :param stage: metrics stage name of the rebuild
+        """
+        self.make_figure = make_figure
+        self.keys = keys
+        self.stage = stage
+        self._state = (None, {})
+
+    def rebuild(self, snapshot: DataSnapshot):
+        with metrics.stage(self.stage):
+            figures = {key: self.make_figure(snapshot.data, *key) for key in self.keys}
+        self._state = (snapshot.version, figures)
+
+    def get(self, snapshot: DataSnapshot, *key) -> dict:
+        version, figures = self._state
+        figure = figures.get(key) if version == snapshot.version else None
+        if figure is None:
+            figure = self.make_figure(snapshot.data, *key)
+            if version == snapshot.version:
+                figures[key] = figure
+        return figure
+
+
+FILTER_OPERATORS = [['ge ', '>='], ['le ', '<='], ['lt ', '<'], ['gt ', '>'], ['ne ', '!='], ['eq ', '='],
+                    ['contains '], ['datestartswith ']]
+
+
+def split_filter_part(filter_part: str):
+    """
+    Split one "{column} operator value" part of a DataTable filter query. The value is returned as typed,
+    unquoted but not converted, since its type depends on the column it is compared with.
+    """
+    for operator_type in FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+                value = value_part.strip()
+                v0 = value[0] if value else ''
+                if len(value) > 1 and v0 == value[-1] and v0 in ("'", '"', '`'):
+                    value = value[1: -1].replace('\\' + v0, v0)
+                # word operators need spaces after them in the filter string, but we don't want these later
+                return name, operator_type[0].strip(), value
+    return [None] * 3
+
+
+def filter_mask(df: "pd.DataFrame", filter_query: str, aliases: dict = None) -> "np.ndarray":
+    """
+    Boolean row mask of a DataTable filter query such as "{Floor 12} > 0.1 && {en} contains Hu".
+    Comparisons with a value that is not a number on a numeric column are ignored, and so are columns
+    that are not in df.
+
+    :param aliases: query column -> df column, for columns the query may still name by an old id
+    """
+    import numpy as np
+    import pandas as pd
+
+    mask = np.ones(len(df), dtype=bool)
+    for filter_part in (filter_query or '').split(' && '):
+        col_name, operator, filter_value = split_filter_part(filter_part)
+        col_name = (aliases or {}).get(col_name, col_name)
+        if col_name not in df.columns:
+            continue
+        column = df[col_name]
+        if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+            if pd.api.types.is_numeric_dtype(column):
+                try:
+                    filter_value = float(filter_value)
+                except ValueError:
+                    continue
+            else:
+                column = column.astype(str)
+            mask &= getattr(column, operator)(filter_value).to_numpy()
+        elif operator == 'contains':
+            mask &= column.astype(str).str.contains(filter_value, case=False, regex=False).to_numpy()
+        elif operator == 'datestartswith':
+            mask &= column.astype(str).str.startswith(filter_value).to_numpy()
+    return mask
+
+
+class TableIndex:
+    """
+    Backend paging, sorting and filtering for the data table of one data snapshot.
+    Row orders for every floor column are sorted once when a snapshot is published, and the names of a
+    language are joined the first time it is requested, so a page request only filters, slices and
+    serializes the visible rows.
+    """
+
+    def __init__(self):
+        self._state = (None, None, {}, {})
+
+    @metrics.staged("utilization.table_index")
+    def rebuild(self, snapshot: DataSnapshot):
+        import numpy as np
+
+        df = snapshot.data.reset_index(drop=True)
+        orders = {}
+        for floor in FLOORS:
+            rates = df[floor].to_numpy()
+            # NaN (character not used on this floor) sorts last in both directions
+            orders[(floor, 'asc')] = np.argsort(rates, kind='stable')
+            orders[(floor, 'desc')] = np.argsort(-rates, kind='stable')
+        self._state = (snapshot.version, df, orders, {})
+
+    @staticmethod
+    def _view(df: "pd.DataFrame", language: str) -> "pd.DataFrame":
+        """ Table columns of the snapshot: the names of the language and the floor rates """
+        view = df[FLOORS].copy()
+        view.insert(0, language, translate(df["item"], language).to_numpy())
+        return view
+
+    def page(self, snapshot: DataSnapshot, language: str, page_current: int, page_size: int, sort_by: list,
+             filter_query: str):
+        """
+        (records of the requested page with only the selected language column, page count).
+        A sort or filter on the name column of another language, left over from before a language switch,
+        applies to the names of the selected language; other unknown columns are ignored.
+        """
+        import numpy as np
+
+        version, df, orders, views = self._state
+        if version != snapshot.version:
+            df, orders, views = snapshot.data.reset_index(drop=True), {}, {}
+        view = views.get(language)
+        if view is None:
+            view = views[language] = self._view(df, language)
+        name_columns = {lang: language for lang in AVAILABLE_LANGUAGES.keys()}
+        column = name_columns.get(sort_by[0]['column_id'], sort_by[0]['column_id']) if sort_by else None
+        if column in view.columns:
+            direction = sort_by[0]['direction']
+            order = orders.get((column, direction))
+            if order is None:
+                order = np.argsort(view[column].to_numpy(), kind='stable')
+                if direction == 'desc':
+                    order = order[::-1]
+        else:
+            order = np.arange(len(view))
+        if filter_query:
+            order = order[filter_mask(view, filter_query, name_columns)[order]]
+        page_current = page_current or 0
+        rows = order[page_current * page_size: (page_current + 1) * page_size]
+        records = view.iloc[rows].to_dict('records')
+        return records, max(1, -(-len(order) // page_size))
+
+
+# Stable artifact name -> (digest of the data it was rendered from, content-hashed file name) of the last export
+static_exports = {}
+
+
+def publish_static(name: str, digest, publish, output_dir: str) -> str:
+    """
+    Content-hashed file name of an exported artifact: the one of the last export if it was rendered from data
+    with the same digest and is still on disk, otherwise the one publish() returns after rendering it again
+    """
+    last = static_exports.get(name)
+    if last is not None and last[0] == digest and os.path.exists(os.path.join(output_dir, last[1])):
+        return last[1]
+    hashed_name = publish()
+    static_exports[name] = (digest, hashed_name)
+    return hashed_name
+
+
+@metrics.staged("utilization.static_export")
+def export_static(snapshot: DataSnapshot):
+    """
+    Pre-render the dashboard of a snapshot for static serving: the usage figure of every (floor, num_bins),
+    the trend figure of every floor, the table of every language with its row order for each
+    floor, and the item names. Artifacts whose data did not change since the last export are not rendered
+    again. The index read by the page is published last and switches visitors to the new files at once.
+    Errors reach the refresher, which logs them and keeps the previous export.
+    """
+    import dash_bootstrap_components as dbc
+    import numpy as np
+
+    output_dir = resource_path(artifacts.OUTPUT_DIR)
+    df = snapshot.data.reset_index(drop=True)
+    files = {"names": None, "figures": {}, "trends": {}, "tables": {}}
+    files["names"] = publish_static(
+        "live-names.json", (frame_digest(df[["item"]]), dictionary_version),
+        lambda: artifacts.publish_json(make_item_names(df), "live-names.json", output_dir), output_dir)
+    for floor in FLOORS:
+        slug = floor.lower().replace(" ", "-")
+        # The figures and the trend of a floor only depend on its rates of the current schedule
+        floor_digest = frame_digest(df[["schedule", "item", floor]])
+        files["figures"][floor] = {}
+        for num_bins in NUM_BINS_OPTIONS:
+            name = "live-figure-%s-%d.json" % (slug, num_bins)
+            files["figures"][floor][num_bins] = publish_static(
+                name, floor_digest,
+                lambda: artifacts.publish_json(make_utilization_figure(df, floor, num_bins), name, output_dir),
+                output_dir)
+        name = "live-trend-%s.json" % slug
+        files["trends"][floor] = publish_static(
+            name, floor_digest, lambda: artifacts.publish_json(make_trend_figure(df, floor), name, output_dir),
+            output_dir)
+    # Rows as the table shows them, ordered by each floor's rate like a floor selection sorts the table
+    rates = df[FLOORS].astype("float64").round(6).to_numpy().tolist()
+    orders = {floor: np.argsort(-df[floor].to_numpy(), kind='stable').tolist() for floor in FLOORS}
+    table_digest = (frame_digest(df), dictionary_version)
+    for lang in AVAILABLE_LANGUAGES.keys():
+        name = "live-table-%s.json" % lang
+        files["tables"][lang] = publish_static(
+            name, table_digest,
+            lambda: artifacts.publish_json({"columns": [lang] + FLOORS,
+                                            "rows": [[item_name] + row for item_name, row in
+                                                     zip(translate(df["item"], lang), rates)],
+                                            "orders": orders}, name, output_dir),
+            output_dir)
+    artifacts.publish_json({
+        "version": snapshot.version,
+        "schedule": int(df["schedule"].iloc[0]),
+        "updated_at": snapshot.loaded_at,
+        "floors": FLOORS,
+        "languages": AVAILABLE_LANGUAGES,
+        "num_bins": sorted(NUM_BINS_OPTIONS),
+        "defaults": {"floor": FLOORS[0], "language": DEFAULT_LANGUAGE, "num_bins": DEFAULT_NUM_BINS},
+        "page_size": TABLE_PAGE_SIZE,
+        "files": files,
+    }, static_export.INDEX_FILE, output_dir)
+    page = static_export.page_html(DASHBOARD_TITLE, dbc.themes.JOURNAL)
+    publish_static("index.html", page, lambda: artifacts.publish(page, "index.html", output_dir), output_dir)
 
 
 def resource_path(relative_path):
@@ -66,239 +545,356 @@ def resource_path(relative_path):
     return path.join(base_path, relative_path)
 
 
-if __name__ == "__main__":
-    df = make_current_utilization_rate_data()
+def make_refresher() -> DataRefresher:
+    """ Refresher of the utilization dataset, which also appends every new snapshot to the local history """
+    refresher = DataRefresher(load_utilization_data, REFRESH_INTERVAL, fingerprint=utilization_fingerprint)
+    refresher.on_refresh(record_history)
+    if STATIC_EXPORT:
+        refresher.on_refresh(export_static)
+    return refresher
+
+
+def initial_refresh(refresher: DataRefresher):
+    """ Start from the last cached Homa responses; the refresher then revalidates them right away """
+    if not refresher.refresh(lambda: load_utilization_data(cached_only=True)):
+        raise RuntimeError("Unable to load initial data from Homa API")
+
+
+def run_shared_refresher():
+    """ Refresher process of the multi-worker server: publishes every snapshot as the shared dataset """
+    shared_metrics.start()
+    dataset = SharedDataset(SHARED_DATASET_DIR)
+    refresher = make_refresher()
+    refresher.on_refresh(lambda snapshot: dataset.publish(snapshot.data))
+    initial_refresh(refresher)
+    refresher.run(delay=0)
+
+
+def create_app(refresher) -> "Dash":
+    """
+    Build the dashboard on a snapshot source that already holds data: a DataRefresher in this process or,
+    with several web workers, a SharedDatasetReader of the dataset published by the refresher process
+    """
+    from dash import Dash, html, dash_table, dcc, Output, Input, State
+    import dash_bootstrap_components as dbc
+    from flask import Response, g, request, send_from_directory
+
+    OUTPUT_DIR = resource_path(artifacts.OUTPUT_DIR)
+    # The web workers of the multi-worker server do not run the loader: with every new snapshot they take
+    # the dictionary its loader stored in the shared HTTP cache, before the listeners below name items.
+    # A dictionary change alone publishes a new snapshot, see utilization_fingerprint
+    if isinstance(refresher, SharedDatasetReader):
+        refresher.on_refresh(lambda snapshot: update_translation_table(shared=True))
+    figure_cache = FigureCache(make_utilization_figure,
+                               [(floor, num_bins) for floor in FLOORS for num_bins in NUM_BINS_OPTIONS],
+                               "utilization.figures")
+    figure_cache.rebuild(refresher.get())
+    refresher.on_refresh(figure_cache.rebuild)
+    # The history scan behind a trend runs once per snapshot and floor; record_history has already
+    # appended the snapshot when these listeners run
+    trend_cache = FigureCache(make_trend_figure, [(floor,) for floor in FLOORS], "utilization.trends")
+    trend_cache.rebuild(refresher.get())
+    refresher.on_refresh(trend_cache.rebuild)
+    table_index = TableIndex()
+    table_index.rebuild(refresher.get())
+    refresher.on_refresh(table_index.rebuild)
     dropdown_options = [{'label': v, 'value': k} for k, v in AVAILABLE_LANGUAGES.items()]
 
     app = Dash(__name__, external_stylesheets=[dbc.themes.JOURNAL], assets_folder=resource_path('assets'))
-    app.title = 'Spiral Abyss Live Report by Masterain'
-
-    # Main app layout
-    app.layout = html.Div([
-        dbc.Navbar(
-            dbc.Container(
-                [
-                    dbc.Row(
-                        [
-                            dbc.Col(
-                                dbc.NavbarBrand(
-                                    html.A([
-                                        html.Img(
-                                            src='assets/img/masterain.webp',
-                                            height="30px", width="30px"),
-                                        " Spiral Abyss Live Report"
-                                    ], href="#", style={'color': 'white', 'text-decoration': 'none'}),
-                                    className="navbar-brand"
-                                )
-                            ),
-                            dbc.Col(
-                                dbc.Nav(
-                                    [
-                                        dbc.NavItem(dbc.NavLink("Home", href="/", style={'color': 'white'})),
-                                        dbc.NavItem(
-                                            dbc.NavLink("Snap Hutao", href="https://hut.ao", style={'color': 'white'})),
-                                        dbc.NavItem(
-                                            dbc.NavLink("Pizza Helper for Genshin",
-                                                        href="https://apps.apple.com/pw/app/pizza-helper-for-genshin"
-                                                             "/id1635319193",
-                                                        style={'color': 'white'})),
-                                    ],
-                                    className="ml-auto flex-nowrap mt-3 mt-md-0", navbar=True
+    app.title = DASHBOARD_TITLE
+
+    def load_uploader_regions() -> list:
+        """ Regions with a published uploader report, from the index written by the report generator """
+        try:
+            with open(os.path.join(OUTPUT_DIR, UPLOADER_REGION_INDEX), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return [{"label": "All", "title": "All Regions", "file": "uploader_info.html"}]
+
+    @app.server.route('/metrics')
+    def serve_metrics():
+        body = shared_metrics.render() if shared_metrics is not None else metrics.REGISTRY.render()
+        return Response(body, content_type=metrics.CONTENT_TYPE)
+
+    @app.server.before_request
+    def start_callback_timer():
+        g.request_start = time.perf_counter()
+
+    @app.server.after_request
+    def record_callback_latency(response):
+        # Every Dash callback is a POST to this endpoint; the output id tells them apart. Only outputs of
+        # registered callbacks become labels, so arbitrary request bodies cannot add series
+        if request.path.endswith('/_dash-update-component') and 'request_start' in g:
+            body = request.get_json(silent=True)
+            output = body.get('output') if isinstance(body, dict) else None
+            if not isinstance(output, str) or output not in app.callback_map:
+                output = 'unknown'
+            metrics.CALLBACK_SECONDS.observe(time.perf_counter() - g.request_start,
+                                             output=output, status=response.status_code)
+        return response
+
+    @app.server.route('/output/<path:file_name>')
+    def serve_output(file_name: str):
+        """ Report artifacts, served from their precompressed variant when the client accepts it """
+        response = None
+        accepted = request.headers.get('Accept-Encoding', '')
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if encoding in accepted and os.path.isfile(os.path.join(OUTPUT_DIR, file_name + suffix)):
+                response = send_from_directory(OUTPUT_DIR, file_name + suffix,
+                                               mimetype=mimetypes.guess_type(file_name)[0])
+                response.headers['Content-Encoding'] = encoding
+                break
+        if response is None:
+            response = send_from_directory(OUTPUT_DIR, file_name)
+        response.headers['Vary'] = 'Accept-Encoding'
+        # Content-hashed names never change, the stable names are revalidated on every load
+        if file_name in artifacts.read_manifest(OUTPUT_DIR).values():
+            response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        else:
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    # Main app layout, rebuilt on each page load from the current data snapshot
+    def serve_layout():
+        df = refresher.get().data
+        uploader_regions = load_uploader_regions()
+        return html.Div([
+            dbc.Navbar(
+                dbc.Container(
+                    [
+                        dbc.Row(
+                            [
+                                dbc.Col(
+                                    dbc.NavbarBrand(
+                                        html.A([
+                                            html.Img(
+                                                src='assets/img/masterain.webp',
+                                                height="30px", width="30px"),
+                                            " Spiral Abyss Live Report"
+                                        ], href="#", style={'color': 'white', 'text-decoration': 'none'}),
+                                        className="navbar-brand"
+                                    )
                                 ),
-                                width="auto"
+                                dbc.Col(
+                                    dbc.Nav(
+                                        [
+                                            dbc.NavItem(dbc.NavLink("Home", href="/", style={'color': 'white'})),
+                                            dbc.NavItem(
+                                                dbc.NavLink("Snap Hutao", href="https://hut.ao", style={'color': 'white'})),
+                                            dbc.NavItem(
+                                                dbc.NavLink("Pizza Helper for Genshin",
+                                                            href="https://apps.apple.com/pw/app/pizza-helper-for-genshin"
+                                                                 "/id1635319193",
+                                                            style={'color': 'white'})),
+                                        ],
+                                        className="ml-auto flex-nowrap mt-3 mt-md-0", navbar=True
+                                    ),
+                                    width="auto"
+                                ),
+                            ],
+                            align="center",
+                            className="no-gutters",
+                        ),
+                        dbc.NavItem(
+                            dbc.NavLink(
+                                html.A([
+                                    html.Img(
+                                        src='assets/img/github-mark.svg',
+                                        height="30px", width="30px")
+                                ], href="https://github.com/Masterain98")
                             ),
-                        ],
-                        align="center",
-                        className="no-gutters",
-                    ),
-                    dbc.NavItem(
-                        dbc.NavLink(
-                            html.A([
-                                html.Img(
-                                    src='assets/img/github-mark.svg',
-                                    height="30px", width="30px")
-                            ], href="https://github.com/Masterain98")
+                            className="ml-auto"
                         ),
-                        className="ml-auto"
-                    ),
-                ]
+                    ]
+                ),
+                color="primary",
+                dark=True,
             ),
-            color="primary",
-            dark=True,
-        ),
-        dbc.Container([
-            dbc.Row([
-                dbc.Col([
-                    dbc.Card([
-                        dbc.CardHeader("Select Floor to Display Data", className="mb-2"),
-                        dbc.CardBody([
-                            dbc.RadioItems(options=[{"label": "Floor 9", "value": "Floor 9"},
-                                                    {"label": "Floor 10", "value": "Floor 10"},
-                                                    {"label": "Floor 11", "value": "Floor 11"},
-                                                    {"label": "Floor 12", "value": "Floor 12"}],
-                                           value="Floor 9", id="floor_radio_control", inline=True,
-                                           className="mb-2"),
-                        ])
-                    ], className="mb-3"),
-                ], width=6),
-                dbc.Col([
-                    dbc.Card([
-                        dbc.CardHeader("Select Language"),
-                        dbc.CardBody([
-                            dcc.Dropdown(
-                                id='language_dropdown',
-                                options=dropdown_options,
-                                value='chs',  # Set the initial value to Simplified Chinese
-                            ),
-                        ])
-                    ], className="mb-3"),
-                ], width=6),
-            ]),
-            dcc.Store(id='num_bins_store', storage_type='session'),
-            dbc.Row([
-                dbc.Col([
-                    dbc.Card([
-                        dbc.CardHeader("Character Usage Data Diagram"),
-                        dbc.CardBody([
-                            dcc.Graph(figure={}, id="floor_utilization_rate_graph"),
-                            html.Label("Set number of character display",
-                                       style={'fontSize': 18, 'marginBottom': '10px'}),
-                            dcc.Slider(
-                                id='num_bins_slider',
-                                min=1,
-                                max=50,
-                                step=5,
-                                value=15,
-                            ),
-                        ])
-                    ], className="mb-3"),
-                ], width=6),
-                dbc.Col([
-                    dbc.Card([
-                        dbc.CardHeader("Full Data Table"),
-                        dbc.CardBody([
-                            dash_table.DataTable(
-                                id='data_table',
-                                data=df.to_dict('records'),
-                                page_size=15,
-                                sort_action='native',
-                                sort_mode='single',
-                                columns=[
-                                    {"name": "chs", "id": "chs", "type": "text"},
-                                    {"name": "Floor 9", "id": "Floor 9", "type": "numeric",
-                                     "format": {"specifier": ".2%"}},
-                                    {"name": "Floor 10", "id": "Floor 10", "type": "numeric",
-                                     "format": {"specifier": ".2%"}},
-                                    {"name": "Floor 11", "id": "Floor 11", "type": "numeric",
-                                     "format": {"specifier": ".2%"}},
-                                    {"name": "Floor 12", "id": "Floor 12", "type": "numeric",
-                                     "format": {"specifier": ".2%"}}
-                                ],
-                                style_header={
-                                    'backgroundColor': 'rgb(230, 230, 230)',
-                                    'fontWeight': 'bold'
-                                },
-                                style_cell={
-                                    'backgroundColor': 'rgb(255, 255, 255)',
-                                    'color': 'black',
-                                    'border': '1px solid grey'
-                                },
-                                style_data_conditional=[
-                                    {
-                                        'if': {'row_index': 'odd'},
-                                        'backgroundColor': 'rgb(248, 248, 248)'
-                                    }
-                                ]
-                            )
-
-                        ])
-                    ], className="mb-3"),
-                ], width=6)
-            ])
-        ], fluid=True),
-
-        dbc.Card([
-            dbc.CardHeader("Uploader Info"),
-            dbc.CardBody([
-                html.Iframe(src='./assets/output/uploader_info.html', width='90%', height='900')
-            ])
-        ], className="mb-3"),
-
-        html.Div([
-            html.Span([
-                "© 2023 ",
-                html.A("Masterain", href="https://github.com/Masterain98", style={'color': 'inherit'}),
-                "; Data provided by Hutao API"
-            ])
-        ], id='mail-footer', style={
-            'font-family': 'Roboto-Regular, Helvetica, Arial, sans-serif',
-            'width': '100%',
-            'display': 'flex',
-            'flex-direction': 'column',
-            'text-align': 'center',
-            'font-size': '11px',
-            'color': 'rgb(0 0 0 / 0.54)',
-            'line-height': '18px',
-        }),
-    ])
+            dbc.Container([
+                dbc.Row([
+                    dbc.Col([
+                        dbc.Card([
+                            dbc.CardHeader("Select Floor to Display Data", className="mb-2"),
+                            dbc.CardBody([
+                                dbc.RadioItems(options=[{"label": "Floor 9", "value": "Floor 9"},
+                                                        {"label": "Floor 10", "value": "Floor 10"},
+                                                        {"label": "Floor 11", "value": "Floor 11"},
+                                                        {"label": "Floor 12", "value": "Floor 12"}],
+                                               value=FLOORS[0], id="floor_radio_control", inline=True,
+                                               className="mb-2"),
+                            ])
+                        ], className="mb-3"),
+                    ], width=6),
+                    dbc.Col([
+                        dbc.Card([
+                            dbc.CardHeader("Select Language"),
+                            dbc.CardBody([
+                                dcc.Dropdown(
+                                    id='language_dropdown',
+                                    options=dropdown_options,
+                                    value=DEFAULT_LANGUAGE,
+                                ),
+                            ])
+                        ], className="mb-3"),
+                    ], width=6),
+                ]),
+                dcc.Store(id='num_bins_store', storage_type='session'),
+                dcc.Store(id='base_figure_store'),
+                dcc.Store(id='trend_figure_store'),
+                dcc.Store(id='item_names_store', data=make_item_names(df)),
+                dbc.Row([
+                    dbc.Col([
+                        dbc.Card([
+                            dbc.CardHeader("Character Usage Data Diagram"),
+                            dbc.CardBody([
+                                dcc.Graph(figure={}, id="floor_utilization_rate_graph"),
+                                html.Label("Set number of character display",
+                                           style={'fontSize': 18, 'marginBottom': '10px'}),
+                                dcc.Slider(
+                                    id='num_bins_slider',
+                                    min=1,
+                                    max=50,
+                                    step=5,
+                                    value=DEFAULT_NUM_BINS,
+                                ),
+                            ])
+                        ], className="mb-3"),
+                    ], width=6),
+                    dbc.Col([
+                        dbc.Card([
+                            dbc.CardHeader("Full Data Table"),
+                            dbc.CardBody([
+                                dash_table.DataTable(
+                                    id='data_table',
+                                    data=[],
+                                    page_current=0,
+                                    page_size=TABLE_PAGE_SIZE,
+                                    page_action='custom',
+                                    sort_action='custom',
+                                    sort_mode='single',
+                                    filter_action='custom',
+                                    filter_query='',
+                                    columns=[
+                                        {"name": "chs", "id": "chs", "type": "text"},
+                                        {"name": "Floor 9", "id": "Floor 9", "type": "numeric",
+                                         "format": {"specifier": ".2%"}},
+                                        {"name": "Floor 10", "id": "Floor 10", "type": "numeric",
+                                         "format": {"specifier": ".2%"}},
+                                        {"name": "Floor 11", "id": "Floor 11", "type": "numeric",
+                                         "format": {"specifier": ".2%"}},
+                                        {"name": "Floor 12", "id": "Floor 12", "type": "numeric",
+                                         "format": {"specifier": ".2%"}}
+                                    ],
+                                    style_header={
+                                        'backgroundColor': 'rgb(230, 230, 230)',
+                                        'fontWeight': 'bold'
+                                    },
+                                    style_cell={
+                                        'backgroundColor': 'rgb(255, 255, 255)',
+                                        'color': 'black',
+                                        'border': '1px solid grey'
+                                    },
+                                    style_data_conditional=[
+                                        {
+                                            'if': {'row_index': 'odd'},
+                                            'backgroundColor': 'rgb(248, 248, 248)'
+                                        }
+                                    ]
+                                )
 
-    # Add controls to build the interaction
-    @callback(
-        Output(component_id="floor_utilization_rate_graph", component_property='figure'),
-        [Input(component_id="floor_radio_control", component_property='value'),
-         Input('num_bins_store', 'data'),
-         Input('language_dropdown', 'value')]
-    )
-    def update_graph(col_chosen: str, num_bins: int, lang_chosen: str = 'chs'):
-        # Limit the dataframe to the top num_bins characters
-        limited_df = df.nlargest(num_bins, col_chosen)
-
-        # Convert RGB colors to HSV
-        gold_rgb = np.array([252, 163, 38]) / 255
-        blue_rgb = np.array([89, 200, 228]) / 255
-        gold_hsv = mcolors.rgb_to_hsv(gold_rgb)
-        blue_hsv = mcolors.rgb_to_hsv(blue_rgb)
-
-        # Create a color array with HSV values
-        if num_bins > 1:
-            colors_hsv = [(gold_hsv[0] + i / (num_bins - 1) * (blue_hsv[0] - gold_hsv[0]),
-                           gold_hsv[1] + i / (num_bins - 1) * (blue_hsv[1] - gold_hsv[1]),
-                           gold_hsv[2] + i / (num_bins - 1) * (blue_hsv[2] - gold_hsv[2])) for i in range(num_bins)]
-        else:
-            colors_hsv = [gold_hsv]
+                            ])
+                        ], className="mb-3"),
+                    ], width=6)
+                ])
+            ], fluid=True),
 
-        # Convert HSV colors back to RGB
-        colors = ['rgb' + str(tuple(int(j * 255) for j in mcolors.hsv_to_rgb(i))) for i in colors_hsv]
+            dbc.Card([
+                dbc.CardHeader("Character Usage Trend"),
+                dbc.CardBody([
+                    dcc.Graph(figure={}, id="utilization_trend_graph"),
+                ])
+            ], className="mb-3"),
 
-        text_values = [f'{val:.2%}' for val in limited_df[col_chosen]]
+            dbc.Card([
+                dbc.CardHeader("Uploader Info"),
+                dbc.CardBody([
+                    dcc.Dropdown(
+                        id='uploader_region_dropdown',
+                        options=[{'label': region["title"], 'value': region["file"]} for region in uploader_regions],
+                        value=uploader_regions[0]["file"],
+                        clearable=False,
+                        className="mb-2"
+                    ),
+                    html.Iframe(id='uploader_info_frame', width='90%', height='900')
+                ])
+            ], className="mb-3"),
 
-        fig = go.Figure(data=[go.Bar(
-            x=limited_df[lang_chosen],
-            y=limited_df[col_chosen],
-            marker_color=colors,  # use the color array here
-            marker_line_color='rgb(8,48,107)',
-            marker_line_width=1.5,
-            text=text_values,
-            textposition='outside'
-        )])
+            html.Div([
+                html.Span([
+                    "© 2023 ",
+                    html.A("Masterain", href="https://github.com/Masterain98", style={'color': 'inherit'}),
+                    "; Data provided by Hutao API"
+                ])
+            ], id='mail-footer', style={
+                'font-family': 'Roboto-Regular, Helvetica, Arial, sans-serif',
+                'width': '100%',
+                'display': 'flex',
+                'flex-direction': 'column',
+                'text-align': 'center',
+                'font-size': '11px',
+                'color': 'rgb(0 0 0 / 0.54)',
+                'line-height': '18px',
+            }),
+        ])
 
-        fig.update_layout(
-            yaxis_tickformat=".0%",
-            xaxis={'categoryorder': 'total descending'}
-        )
+    app.layout = serve_layout
+
+    # Add controls to build the interaction
+    @app.callback(
+        Output('base_figure_store', 'data'),
+        [Input(component_id="floor_radio_control", component_property='value'),
+         Input('num_bins_store', 'data')]
+    )
+    def update_graph(col_chosen: str, num_bins: int):
+        return figure_cache.get(refresher.get(), col_chosen, num_bins)
 
-        return fig
 
+    # Switching the label language only swaps the x-axis labels in the browser
+    app.clientside_callback(
+        """
+        function(figure, language, names) {
+            if (!figure) {
+                return window.dash_clientside.no_update;
+            }
+            const lookup = (names && names[language]) || {};
+            const ids = figure.data[0].x;
+            const labels = ids.map(id => lookup[id] || id);
+            return {
+                data: [Object.assign({}, figure.data[0], {hovertext: labels})],
+                layout: Object.assign({}, figure.layout, {
+                    xaxis: Object.assign({}, figure.layout.xaxis, {tickvals: ids, ticktext: labels})
+                })
+            };
+        }
+        """,
+        Output(component_id="floor_utilization_rate_graph", component_property='figure'),
+        [Input('base_figure_store', 'data'),
+         Input('language_dropdown', 'value')],
+        State('item_names_store', 'data')
+    )
 
-    @callback(
+
+    # A language switch renames the name column, so a sort on the old one falls back to the floor's
+    @app.callback(
         Output('data_table', 'sort_by'),
-        Input('floor_radio_control', 'value')
+        [Input('floor_radio_control', 'value'),
+         Input('language_dropdown', 'value')]
     )
-    def update_sorting(floor_value: str):
+    def update_sorting(floor_value: str, language: str):
         return [{'column_id': floor_value, 'direction': 'desc'}]
 
 
-    @callback(
+    @app.callback(
         Output('num_bins_store', 'data'),
         [Input('num_bins_slider', 'value')]
     )
@@ -307,7 +903,60 @@ if __name__ == "__main__":
 
 
     @app.callback(
-        Output('data_table', 'columns'),
+        [Output('data_table', 'data'),
+         Output('data_table', 'page_count')],
+        [Input('data_table', 'page_current'),
+         Input('data_table', 'page_size'),
+         Input('data_table', 'sort_by'),
+         Input('data_table', 'filter_query'),
+         Input('language_dropdown', 'value')]
+    )
+    def update_table_page(page_current: int, page_size: int, sort_by: list, filter_query: str, language: str):
+        return table_index.page(refresher.get(), language, page_current, page_size, sort_by, filter_query)
+
+
+    @app.callback(
+        Output('trend_figure_store', 'data'),
+        Input('floor_radio_control', 'value')
+    )
+    def update_trend_graph(col_chosen: str):
+        return trend_cache.get(refresher.get(), col_chosen)
+
+
+    # Like the usage chart, a language switch only renames the trend traces in the browser
+    app.clientside_callback(
+        """
+        function(figure, language, names) {
+            if (!figure) {
+                return window.dash_clientside.no_update;
+            }
+            const lookup = (names && names[language]) || {};
+            return {
+                data: figure.data.map(trace => Object.assign({}, trace, {name: lookup[trace.name] || trace.name})),
+                layout: figure.layout
+            };
+        }
+        """,
+        Output('utilization_trend_graph', 'figure'),
+        [Input('trend_figure_store', 'data'),
+         Input('language_dropdown', 'value')],
+        State('item_names_store', 'data')
+    )
+
+
+    @app.callback(
+        Output('uploader_info_frame', 'src'),
+        Input('uploader_region_dropdown', 'value')
+    )
+    def update_uploader_frame(file_name: str):
+        # Only the selected region's report is downloaded by the browser
+        return './output/' + artifacts.resolve(file_name, OUTPUT_DIR)
+
+
+    # The filter is cleared with the column ids it may refer to
+    @app.callback(
+        [Output('data_table', 'columns'),
+         Output('data_table', 'filter_query')],
         [Input('language_dropdown', 'value')]
     )
     def update_table_columns(language: str):
@@ -321,8 +970,39 @@ if __name__ == "__main__":
              "format": {"specifier": ".2%"}},
             {"name": "Floor 12", "id": "Floor 12", "type": "numeric",
              "format": {"specifier": ".2%"}}
-        ]
+        ], ''
+
+
+    return app
+
+
+if __name__ == "__main__":
+    if WEB_WORKERS == 0:
+        # Export only: the static files are the whole dashboard
+        if METRICS_PORT:
+            metrics.serve(METRICS_PORT)
+        refresher = make_refresher()
+        initial_refresh(refresher)
+        refresher.run(delay=0)
+    elif WEB_WORKERS > 1:
+        from wsgi_server import WsgiServer
+
+        # One refresher process publishes the dataset, the web workers memory-map it
+        shared_metrics.clear()
+        reader = SharedDatasetReader(SHARED_DATASET_DIR)
 
+        def start_worker(server, worker):
+            # The app is built in the master; its background threads do not survive the fork
+            shared_metrics.start()
+            reader.start()
 
-    if __name__ == '__main__':
-        app.run_server(debug=False, host='0.0.0.0')
+        WsgiServer(lambda: create_app(reader).server,
+                   {"bind": "0.0.0.0:%d" % WEB_PORT, "workers": WEB_WORKERS, "threads": WEB_THREADS, "timeout": 60,
+                    "post_fork": start_worker},
+                   sidecar=run_shared_refresher).run()
+    else:
+        refresher = make_refresher()
+        initial_refresh(refresher)
+        app = create_app(refresher)
+        refresher.start(delay=0)
+        app.run_server(debug=False, host='0.0.0.0', port=WEB_PORT)
@@ -0,0 +1,106 @@
+import json
+from dataclasses import dataclass
+from typing import Any
+
+from MysqlConn import MysqlConn
+
+STATISTICS_TABLE = "spiral_abysses_statistics"
+# Version probe of cached statistics reads: rows are added or removed once per schedule
+STATISTICS_VERSION = "SELECT MAX(PrimaryId), COUNT(*) FROM `%s`" % STATISTICS_TABLE
+# Statistic names stored in spiral_abysses_statistics.Name
+STATISTIC_NAMES = (
+    "Overview",
+    "AvatarAppearanceRank",
+    "AvatarUsageRank",
+    "AvatarConstellationInfo",
+    "AvatarCollocation",
+    "WeaponCollocation",
+    "TeamAppearance",
+)
+
+
+@dataclass(frozen=True)
+class OverviewStatistics:
+    schedule_id: int
+    spiral_abyss_total: int
+    spiral_abyss_full_star: int
+
+
+@dataclass(frozen=True)
+class StatisticRecord:
+    schedule_id: int
+    name: str
+    data: Any
+
+
+class StatisticsQuery:
+    """
+    Typed queries over spiral_abysses_statistics. Filtering, ordering, LIMIT and JSON field extraction
+    run in MySQL with bound parameters, so only the requested fields of the requested schedules are transferred.
+    """
+
+    def __init__(self, db: MysqlConn, cache_ttl: float = None):
+        """
+        :param cache_ttl: reuse results of the db's query cache up to this many seconds old while the
+            statistics table is unchanged, None to always query
+        """
+        self.db = db
+        self.cache_ttl = cache_ttl
+
+    def _fetch_all(self, sql: str, params=None):
+        if self.cache_ttl is None:
+            return self.db.fetch_all(sql, params)
+        return self.db.fetch_all(sql, params, ttl=self.cache_ttl, version=STATISTICS_VERSION)
+
+    @staticmethod
+    def _check_name(name: str):
+        if name not in STATISTIC_NAMES:
+            raise ValueError("Unknown statistic name: %s" % name)
+
+    def overview(self, limit: int = 6) -> list[OverviewStatistics]:
+        """ Overview of the most recent `limit` schedules, oldest first """
+        sql = "SELECT ScheduleId, " \
+              "CAST(JSON_EXTRACT(Data, '$.SpiralAbyssTotal') AS UNSIGNED), " \
+              "CAST(JSON_EXTRACT(Data, '$.SpiralAbyssFullStar') AS UNSIGNED) " \
+              "FROM `%s` WHERE Name=%%s ORDER BY ScheduleId DESC LIMIT %%s" % STATISTICS_TABLE
+        rows = self._fetch_all(sql, ("Overview", limit))
+        return [OverviewStatistics(*row) for row in reversed(rows)]
+
+    def extract(self, name: str, paths: dict[str, str], limit: int = 1, schedule_id: int = None) -> list[dict]:
+        """
+        Selected JSON fields of one statistic, most recent schedule first
+
+        :param paths: result key -> JSON path inside Data, e.g. {"total": "$.SpiralAbyssTotal"}
+        :param schedule_id: only return this schedule
+        """
+        self._check_name(name)
+        keys = list(paths.keys())
+        sql = "SELECT ScheduleId, %s FROM `%s` WHERE Name=%%s" % (
+            ", ".join("JSON_EXTRACT(Data, %s)" for _ in keys), STATISTICS_TABLE)
+        params = [*paths.values(), name]
+        if schedule_id is not None:
+            sql += " AND ScheduleId=%s"
+            params.append(schedule_id)
+        sql += " ORDER BY ScheduleId DESC LIMIT %s"
+        params.append(limit)
+        rows = self._fetch_all(sql, params)
+        return [dict(ScheduleId=row[0], **{k: json.loads(v) if v is not None else None for k, v in zip(keys, row[1:])})
+                for row in rows]
+
+    def latest(self, name: str, limit: int = 1, schedule_id: int = None) -> list[StatisticRecord]:
+        """ Full Data of one statistic for the most recent `limit` schedules (or one schedule), most recent first """
+        self._check_name(name)
+        sql = "SELECT ScheduleId, Data FROM `%s` WHERE Name=%%s" % STATISTICS_TABLE
+        params = [name]
+        if schedule_id is not None:
+            sql += " AND ScheduleId=%s"
+            params.append(schedule_id)
+        sql += " ORDER BY ScheduleId DESC LIMIT %s"
+        params.append(limit)
+        rows = self._fetch_all(sql, params)
+        return [StatisticRecord(row[0], name, json.loads(row[1])) for row in rows]
+
+    def schedules(self) -> list[int]:
+        """ All schedule IDs with statistics, ascending """
+        rows = self._fetch_all("SELECT DISTINCT ScheduleId FROM `%s` ORDER BY ScheduleId" % STATISTICS_TABLE)
+        return [row[0] for row in rows]
@@ -0,0 +1,199 @@
+import base64
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+
+import brotli
+import orjson
+
+import metrics
+
+if TYPE_CHECKING:
+    import numpy as np
+
+OUTPUT_DIR = "assets/output"
+MANIFEST_FILE = "manifest.json"
+# plotly.js >= 2.35 decodes base64 typed arrays ({"dtype": ..., "bdata": ...})
+PLOTLY_JS_URL = os.getenv('PLOTLY_JS_URL', "https://cdn.plot.ly/plotly-2.35.2.min.js")
+# Brotli 11 is several times slower than 9 for a few percent smaller files; artifacts are rebuilt on a schedule
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', 9))
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>{title}</title></head>
+<body style="margin:0">
+<div id="figure" style="width:100%;height:100vh"></div>
+<script src="{plotly_js}"></script>
+<script>
+const figure = {figure};
+Plotly.newPlot("figure", figure.data, figure.layout, {{"responsive": true}});
+</script>
+</body>
+</html>
+"""
+
+_manifest_lock = threading.Lock()
+
+
+@contextmanager
+def _locked_manifest(output_dir: str):
+    """
+    Exclusive access to the manifest of output_dir, across threads and across the processes publishing
+    into the same directory (the report generator and the dashboard's static export)
+    """
+    with _manifest_lock, open(os.path.join(output_dir, MANIFEST_FILE + ".lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _typed_array(array: "np.ndarray") -> dict:
+    import numpy as np
+
+    if array.dtype.kind == "M":
+        # Dates as milliseconds since epoch; the axis needs type "date"
+        array = array.astype("datetime64[ms]").astype(np.float64)
+    elif array.dtype.kind in "iu" and array.dtype.itemsize == 8:
+        info = np.iinfo(np.int32)
+        if len(array) and (array.min() < info.min or array.max() > info.max):
+            array = array.astype(np.float64)
+        else:
+            array = array.astype(np.int32)
+    elif array.dtype.kind == "b":
+        array = array.astype(np.uint8)
+    array = np.ascontiguousarray(array)
+    dtype = array.dtype.str.lstrip("<|=")
+    return {"dtype": dtype, "bdata": base64.b64encode(array.tobytes()).decode("ascii")}
+
+
+def compact_arrays(value):
+    """ Replace numeric and datetime numpy arrays in a figure dict by base64 typed arrays """
+    import numpy as np
+
+    if isinstance(value, np.ndarray):
+        if value.ndim == 1 and value.dtype.kind in "iufbM":
+            return _typed_array(value)
+        return compact_arrays(value.tolist())
+    if isinstance(value, dict):
+        return {k: compact_arrays(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [compact_arrays(v) for v in value]
+    return value
+
+
+def _json_default(value):
+    # Scalars orjson does not know natively, e.g. pandas Timestamps and numpy datetimes
+    import numpy as np
+
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("Type is not JSON serializable: %s" % type(value).__name__)
+
+
+@metrics.staged("artifact.html")
+def figure_html(fig, title: str = "") -> bytes:
+    """ Standalone HTML page of a plotly figure with typed-array data, encoded with orjson """
+    figure_json = orjson.dumps(compact_arrays(fig.to_plotly_json()), default=_json_default,
+                               option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    # Keep "</script>" inside strings from closing the script element
+    figure_json = figure_json.replace("</", "<\\/")
+    return HTML_TEMPLATE.format(title=title, plotly_js=PLOTLY_JS_URL, figure=figure_json).encode("utf-8")
+
+
+def _write_atomic(path: str, content: bytes):
+    # Thread idents repeat across processes, so the process id keeps concurrent writers apart
+    tmp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def _compress(content: bytes, quality: int) -> dict:
+    """ File name suffix -> content of the plain, gzip and brotli variants """
+    return {".gz": gzip.compress(content, compresslevel=9), ".br": brotli.compress(content, quality=quality),
+            "": content}
+
+
+def _write_variants(path: str, variants: dict):
+    for suffix, content in variants.items():
+        _write_atomic(path + suffix, content)
+
+
+def read_manifest(output_dir: str = OUTPUT_DIR) -> dict:
+    """ Stable artifact name -> content-hashed file name of its current version """
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def resolve(name: str, output_dir: str = OUTPUT_DIR) -> str:
+    """ Content-hashed file name of an artifact, or the stable name if it was not published through here """
+    return read_manifest(output_dir).get(name, name)
+
+
+@metrics.staged("artifact.write")
+def publish(content: bytes, name: str, output_dir: str = OUTPUT_DIR, keep: int = 3,
+            quality: int = BROTLI_QUALITY) -> str:
+    """
+    Publish an artifact as name.<hash>.ext plus the stable name, each with .gz and .br variants.
+    Every file is written to a temporary name and renamed into place, then the manifest is
+    switched to the new version. The `keep` most recent hashed versions are retained so clients
+    still loading an older page do not get a 404.
+
+    :param quality: brotli quality of the .br variants
+    :return: content-hashed file name
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    stem, ext = os.path.splitext(name)
+    hashed_name = "%s.%s%s" % (stem, hashlib.sha256(content).hexdigest()[:12], ext)
+    hashed_path = os.path.join(output_dir, hashed_name)
+    stable_path = os.path.join(output_dir, name)
+    # Both names get the same compressed bytes, and republishing unchanged content compresses nothing
+    variants = None
+    if os.path.exists(hashed_path):
+        os.utime(hashed_path)
+    else:
+        variants = _compress(content, quality)
+        _write_variants(hashed_path, variants)
+    if read_manifest(output_dir).get(name) != hashed_name or not os.path.exists(stable_path):
+        _write_variants(stable_path, variants or _compress(content, quality))
+
+    with _locked_manifest(output_dir):
+        manifest = read_manifest(output_dir)
+        manifest[name] = hashed_name
+        _write_atomic(os.path.join(output_dir, MANIFEST_FILE),
+                      json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+
+        versions = sorted((f for f in os.listdir(output_dir)
+                           if f.startswith(stem + ".") and f.endswith(ext) and f != name
+                           and len(f) == len(hashed_name)),
+                          key=lambda f: os.path.getmtime(os.path.join(output_dir, f)), reverse=True)
+        for old in versions[keep:]:
+            for suffix in ("", ".gz", ".br"):
+                try:
+                    os.remove(os.path.join(output_dir, old + suffix))
+                except OSError:
+                    pass
+    return hashed_name
+
+
+def publish_figure(fig, name: str, title: str = "", output_dir: str = OUTPUT_DIR) -> str:
+    """ Render a figure as compact HTML and publish it; see publish() """
+    return publish(figure_html(fig, title), name, output_dir)
+
+
+def publish_json(value, name: str, output_dir: str = OUTPUT_DIR) -> str:
+    """ Publish a JSON document, numeric numpy arrays encoded as base64 typed arrays; see publish() """
+    content = orjson.dumps(compact_arrays(value), default=_json_default,
+                           option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return publish(content, name, output_dir)
@@ -0,0 +1,360 @@
+"""
+Benchmark of the report pipeline on synthetic data.
+
+Generates records / spiral_abysses / spiral_abysses_statistics rows at the requested scales, loads them into
+a SQLite stand-in (or the MySQL database configured by the MYSQL_* variables, which must be a scratch database)
+and measures the wall time and peak resident memory of every pipeline stage. Results are written as JSON so
+runs of different commits can be compared.
+
+    python benchmark.py --scales 100k,1M,10M --output benchmark-results.json
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from MysqlConn import MysqlConn
+
+# Schedules covered by the synthetic uploads, newest last
+BENCH_SCHEDULES = 12
+BENCH_LOAD_BATCH = 50000
+# Item IDs of the synthetic utilization data, in the character ID range of the UIGF dictionary
+BENCH_ITEMS = range(10000002, 10000100)
+# Share of spiral_abysses rows without a matching records row
+BENCH_ORPHAN_RATE = 0.01
+# Leading UID digit -> share of uploads, covering every region of main.UID_GROUP
+BENCH_UID_DIGITS = {"1": 0.30, "2": 0.05, "3": 0.05, "5": 0.10, "6": 0.15, "7": 0.12, "8": 0.15, "9": 0.08}
+# Uploader -> share of uploads, including one uploader outside main.UPLOADER_GROUP
+BENCH_UPLOADERS = {"Snap Hutao": 0.55, "Snap Hutao Bookmark": 0.05, "miao-plugin": 0.2, "api-plugin": 0.05,
+                   "GenshinPizzaHelper": 0.14, "Unknown": 0.01}
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS records (PrimaryId BIGINT PRIMARY KEY, Uid VARCHAR(10) NOT NULL, "
+    "Uploader VARCHAR(64) NOT NULL, UploadTime BIGINT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS spiral_abysses (PrimaryId BIGINT PRIMARY KEY, RecordId BIGINT, "
+    "ScheduleId INT NOT NULL, TotalBattleTimes INT NOT NULL, TotalWinTimes INT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS spiral_abysses_statistics (PrimaryId BIGINT PRIMARY KEY, ScheduleId INT NOT NULL, "
+    "Name VARCHAR(64) NOT NULL, Data TEXT NOT NULL)",
+)
+
+RIGHT_JOIN = re.compile(r"(\w+) RIGHT JOIN (\w+) ON")
+
+
+class _SqliteCursor:
+    def __init__(self, cursor: sqlite3.Cursor):
+        self._cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._cursor.close()
+
+    @staticmethod
+    def _sql(sql: str) -> str:
+        # SQLite plans "a RIGHT JOIN b" as a full scan per query; the equivalent LEFT JOIN uses the indexes
+        sql = RIGHT_JOIN.sub(r"\2 LEFT JOIN \1 ON", sql)
+        return sql.replace("%s", "?")
+
+    def execute(self, sql, params=None):
+        self._cursor.execute(self._sql(sql), tuple(params) if params is not None else ())
+        return self._cursor.rowcount
+
+    def executemany(self, sql, rows):
+        self._cursor.executemany(self._sql(sql), rows)
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return tuple(self._cursor.fetchall())
+
+
+class _SqliteConnection:
+    open = True
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+
+    def ping(self, reconnect: bool = False):
+        pass
+
+    def cursor(self):
+        return _SqliteCursor(self._conn.cursor())
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self.open = False
+        self._conn.close()
+
+
+class SqliteConn(MysqlConn):
+    """ MysqlConn over a SQLite file, for running the pipeline's queries without a MySQL server """
+
+    def __init__(self, path: str, pool_size: int = 4):
+        super().__init__(None, 0, None, None, None, pool_size=pool_size)
+        self.path = path
+
+    def _new_connection(self):
+        return _SqliteConnection(self.path)
+
+
+def parse_scale(value: str) -> int:
+    """ "100k" -> 100000, "10M" -> 10000000 """
+    multiplier = {"k": 10 ** 3, "m": 10 ** 6}.get(value[-1].lower(), 1)
+    return int(float(value.rstrip("kKmM")) * multiplier)
+
+
+def generate_uploads(rows: int, seed: int = 0, batch_size: int = BENCH_LOAD_BATCH, now: int = None):
+    """
+    Synthetic upload history in batches of (records rows, spiral_abysses rows). Upload times spread over
+    BENCH_SCHEDULES schedules of about 15 days, with more uploads in the first days of each schedule.
+    """
+    rng = np.random.default_rng(seed)
+    now = now or int(time.time())
+    start = now - BENCH_SCHEDULES * 15 * 86400
+    digits = np.array(list(BENCH_UID_DIGITS.keys()))
+    digit_p = np.array(list(BENCH_UID_DIGITS.values()))
+    uploaders = np.array(list(BENCH_UPLOADERS.keys()))
+    uploader_p = np.array(list(BENCH_UPLOADERS.values()))
+    for low in range(0, rows, batch_size):
+        n = min(batch_size, rows - low)
+        ids = np.arange(low + 1, low + n + 1)
+        schedule = rng.integers(0, BENCH_SCHEDULES, n)
+        upload_time = start + schedule * 15 * 86400 + (rng.exponential(3, n) % 15 * 86400).astype(np.int64)
+        uid = np.char.add(rng.choice(digits, n, p=digit_p / digit_p.sum()),
+                          np.char.zfill(rng.integers(0, 10 ** 8, n).astype(str), 8))
+        uploader = rng.choice(uploaders, n, p=uploader_p / uploader_p.sum())
+        record_id = np.where(rng.random(n) < BENCH_ORPHAN_RATE, -ids, ids)
+        battles = rng.integers(12, 40, n)
+        records = list(zip(ids.tolist(), uid.tolist(), uploader.tolist(), upload_time.tolist()))
+        abysses = list(zip(ids.tolist(), record_id.tolist(), (schedule + 1).tolist(), battles.tolist(),
+                           np.minimum(battles, 12).tolist()))
+        yield records, abysses
+
+
+def generate_statistics(rows: int, seed: int = 0) -> list:
+    """ spiral_abysses_statistics rows: one Overview per schedule, consistent with generate_uploads """
+    rng = np.random.default_rng(seed)
+    per_schedule = max(rows // BENCH_SCHEDULES, 1)
+    result = []
+    for schedule in range(1, BENCH_SCHEDULES + 1):
+        total = int(per_schedule * rng.uniform(0.9, 1.1))
+        data = {"ScheduleId": schedule, "RecordTotal": total, "SpiralAbyssTotal": total,
+                "SpiralAbyssFullStar": int(total * rng.uniform(0.3, 0.6))}
+        result.append((schedule, schedule, "Overview", json.dumps(data)))
+    return result
+
+
+def generate_homa_statistics(item_ids: list, schedule_id: int = BENCH_SCHEDULES, seed: int = 0):
+    """ HomaStatistics payload of the current schedule with a usage rate for every item on every floor """
+    from homa import HomaStatistics
+    rng = np.random.default_rng(seed)
+    utilization_rate = [{"Floor": floor, "Ranks": [{"Item": item, "Rate": float(rate)} for item, rate in
+                                                   zip(item_ids, rng.beta(0.6, 3, len(item_ids)))]}
+                        for floor in (9, 10, 11, 12)]
+    return HomaStatistics(overview={"scheduleId": schedule_id}, utilization_rate=utilization_rate,
+                          fetched_at=time.time())
+
+
+def load(db: MysqlConn, rows: int, seed: int = 0):
+    """ Create the tables and fill them with `rows` synthetic uploads; the tables must be empty """
+    for sql in SCHEMA:
+        if not db.execute(sql):
+            raise RuntimeError("Unable to create benchmark tables")
+    if db.fetch_one("SELECT COUNT(*) FROM spiral_abysses")[0]:
+        raise RuntimeError("spiral_abysses is not empty; benchmarks need a scratch database")
+    for records, abysses in generate_uploads(rows, seed):
+        if not (db.executemany("INSERT INTO records (PrimaryId, Uid, Uploader, UploadTime) VALUES (%s, %s, %s, %s)",
+                               records, batch_size=len(records), atomic=True)
+                and db.executemany("INSERT INTO spiral_abysses (PrimaryId, RecordId, ScheduleId, TotalBattleTimes, "
+                                   "TotalWinTimes) VALUES (%s, %s, %s, %s, %s)",
+                                   abysses, batch_size=len(abysses), atomic=True)):
+            raise RuntimeError("Unable to load benchmark rows")
+    if not db.executemany("INSERT INTO spiral_abysses_statistics (PrimaryId, ScheduleId, Name, Data) "
+                          "VALUES (%s, %s, %s, %s)", generate_statistics(rows, seed), atomic=True):
+        raise RuntimeError("Unable to load benchmark statistics")
+
+
+def memory_status() -> dict:
+    """ Current (VmRSS) and peak (VmHWM) resident set size of this process in kB, empty where /proc is missing """
+    status = {}
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key, value = line.split(":")
+                    status[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return status
+
+
+def reset_peak_rss() -> bool:
+    """ Reset VmHWM to the current RSS (Linux 4.0+); returns False where that is not supported """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class StageRecorder:
+    """
+    Wall time and peak resident memory of named pipeline stages.
+
+    Memory is read from the kernel's RSS high-water mark, reset before each stage, so measuring it costs
+    nothing while the stage runs and covers native allocations (numpy, Arrow) as well. The peak fields are
+    None on platforms without /proc/self/clear_refs.
+    """
+
+    def __init__(self):
+        self.results = []
+
+    @contextmanager
+    def stage(self, name: str, scale: int, **extra):
+        tracked = reset_peak_rss()
+        start_rss = memory_status().get("VmRSS")
+        start = time.perf_counter()
+        result = dict(stage=name, scale=scale, **extra)
+        try:
+            yield result
+        finally:
+            result["seconds"] = round(time.perf_counter() - start, 4)
+            peak = memory_status().get("VmHWM") if tracked else None
+            result["peak_rss_mb"] = round(peak / 2 ** 10, 2) if peak is not None else None
+            # Growth over the RSS the stage started with, i.e. the stage's own working memory
+            result["peak_growth_mb"] = round((peak - start_rss) / 2 ** 10, 2) if peak is not None else None
+            self.results.append(result)
+            print("%-36s %10d rows %9.3fs %9s MB" % (
+                name, scale, result["seconds"],
+                "-" if peak is None else "%.1f" % result["peak_growth_mb"]))
+
+
+def bench_uid_layout(recorder: StageRecorder, scale: int, output_dir: str):
+    import main
+    from artifacts import publish_figure
+    import plotly.graph_objects as go
+
+    with recorder.stage("uid_layout.query", scale) as result:
+        chunks = list(main.db.fetch_chunks(main.UPLOAD_COLUMNS, main.UPLOAD_FROM, main.UPLOAD_KEY,
+                                           chunk_size=main.UPLOAD_CHUNK_SIZE, workers=main.UPLOAD_READ_WORKERS))
+        result["rows"] = sum(len(rows) for rows in chunks)
+    with recorder.stage("uid_layout.frame", scale) as result:
+        df, _ = main.load_upload_frame(chunks=chunks)
+        result["rows"] = len(df)
+    del chunks
+    with recorder.stage("uid_layout.traces", scale) as result:
+        traces = main.partition_uploads(df)
+        figures = {}
+        for region in main.UID_GROUP.keys():
+            figures[main.region_artifact_name(region)] = go.Figure(
+                [main.make_upload_trace(*traces[(region, k)], name=f"{k} {region}", group=k)
+                 for k in main.UPLOADER_COLOR.keys()])
+        result["points"] = sum(len(trace.x) for fig in figures.values() for trace in fig.data)
+    with recorder.stage("uid_layout.html", scale) as result:
+        for name, fig in figures.items():
+            publish_figure(fig, name, output_dir=output_dir)
+        result["bytes"] = sum(os.path.getsize(os.path.join(output_dir, name)) for name in figures.keys())
+
+
+def bench_user_per_schedule_bar(recorder: StageRecorder, scale: int):
+    import main
+
+    with recorder.stage("user_per_schedule_bar.query", scale) as result:
+        result["rows"] = len(main.statistics_query.overview(limit=6))
+    with recorder.stage("user_per_schedule_bar.total", scale):
+        main.user_per_schedule_bar()
+
+
+def bench_utilization_rate_data(recorder: StageRecorder, scale: int):
+    import abyss
+
+    # The utilization frame is keyed on item IDs only, so no dictionary is needed and nothing is fetched
+    statistics = generate_homa_statistics(list(BENCH_ITEMS))
+    with recorder.stage("make_current_utilization_rate_data", scale) as result:
+        result["rows"] = len(abyss.make_current_utilization_rate_data(statistics))
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="100k,1M,10M", help="comma separated row counts, e.g. 100k,1M,10M")
+    parser.add_argument("--backend", choices=("sqlite", "mysql"), default="sqlite",
+                        help="mysql loads into the database configured by the MYSQL_* variables")
+    parser.add_argument("--output", default="benchmark-results.json", help="JSON result file")
+    parser.add_argument("--workdir", default=None, help="directory for databases and artifacts (default: temporary)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # main and abyss are imported from this checkout after the switch to the work directory, so their
+    # relative cache paths resolve there; importing them does no network or database access
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    output = os.path.abspath(args.output)
+    sys.path.insert(0, base_dir)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="hutao-benchmark-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    import main
+
+    recorder = StageRecorder()
+    for scale in (parse_scale(s) for s in args.scales.split(",")):
+        if args.backend == "sqlite":
+            path = os.path.join(workdir, "bench-%d.sqlite" % scale)
+            if os.path.exists(path):
+                os.remove(path)
+            db = SqliteConn(path)
+        else:
+            db = main.db
+        with recorder.stage("load", scale):
+            load(db, scale, args.seed)
+        main.db = db
+        main.statistics_query.db = db
+        bench_uid_layout(recorder, scale, os.path.join(workdir, "output-%d" % scale))
+        bench_user_per_schedule_bar(recorder, scale)
+        bench_utilization_rate_data(recorder, scale)
+        if args.backend == "mysql":
+            for table in ("spiral_abysses_statistics", "spiral_abysses", "records"):
+                db.execute("TRUNCATE TABLE `%s`" % table)
+        db.close()
+
+    report = {
+        "commit": git_commit(),
+        "created_at": time.time(),
+        "backend": args.backend,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {"render_mode": main.UPLOADER_RENDER_MODE, "chunk_size": main.UPLOAD_CHUNK_SIZE,
+                     "read_workers": main.UPLOAD_READ_WORKERS},
+        "stages": recorder.results,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print("Results written to " + output)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,99 @@
+import threading
+import time
+import traceback
+from typing import Any, Callable, NamedTuple
+
+
+class DataSnapshot(NamedTuple):
+    version: int
+    data: Any
+    loaded_at: float
+
+
+class DataRefresher:
+    """
+    Holds the current version of a dataset and rebuilds it in a background thread.
+
+    The loader runs off the request path; its result is swapped in as a new immutable snapshot
+    in one step, so readers always see either the previous or the new complete dataset.
+    """
+
+    def __init__(self, loader: Callable[[], Any], interval: float, fingerprint: Callable[[Any], Any] = None):
+        """
+        :param loader: function that builds a fresh dataset
+        :param interval: seconds between two refreshes
+        :param fingerprint: function returning a comparable identity of a dataset; a refresh whose dataset has
+            the fingerprint of the current snapshot keeps that snapshot and does not notify the listeners
+        """
+        self.loader = loader
+        self.interval = interval
+        self.fingerprint = fingerprint
+        self._fingerprint = None
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._listeners = []
+
+    def get(self) -> DataSnapshot:
+        """ Current snapshot; refresh() must have succeeded at least once """
+        return self._snapshot
+
+    def on_refresh(self, listener: Callable[[DataSnapshot], None]):
+        """ Register a function called with every new snapshot """
+        self._listeners.append(listener)
+
+    def refresh(self, loader: Callable[[], Any] = None) -> bool:
+        """
+        Build a new dataset and swap it in; the current snapshot is kept if the loader fails or the dataset
+        is unchanged. Listener errors are logged and do not affect the result.
+
+        :param loader: use this loader instead of the default one for this refresh only
+        """
+        try:
+            data = (loader or self.loader)()
+        except Exception as e:
+            print("Data refresh failed: " + str(e))
+            return False
+        fingerprint = self.fingerprint(data) if self.fingerprint is not None else None
+        with self._lock:
+            if fingerprint is not None and self._snapshot is not None and fingerprint == self._fingerprint:
+                return True
+            self._fingerprint = fingerprint
+            version = self._snapshot.version + 1 if self._snapshot is not None else 1
+            self._snapshot = DataSnapshot(version, data, time.time())
+            snapshot = self._snapshot
+        # A failing listener must not keep the others from seeing the snapshot or stop the refresh loop
+        for listener in self._listeners:
+            try:
+                listener(snapshot)
+            except Exception:
+                print("Data refresh listener %s failed:\n%s" % (getattr(listener, "__name__", listener),
+                                                                traceback.format_exc()))
+        return True
+
+    def _run(self, delay: float):
+        while not self._stop.wait(delay):
+            try:
+                self.refresh()
+            except Exception:
+                print("Data refresh loop error:\n" + traceback.format_exc())
+            delay = self.interval
+
+    def start(self, delay: float = None):
+        """
+        Start refreshing in a daemon thread
+
+        :param delay: seconds before the first refresh, defaults to the refresh interval
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(self.interval if delay is None else delay,),
+                                            name="data-refresher", daemon=True)
+            self._thread.start()
+
+    def run(self, delay: float = None):
+        """ Refresh in the calling thread until stop() is called; see start() """
+        self._run(self.interval if delay is None else delay)
+
+    def stop(self):
+        self._stop.set()
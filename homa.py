@@ -0,0 +1,104 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+import metrics
+from http_cache import HttpCache
+
+# HomaStatistics field -> Homa API path
+HOMA_ENDPOINTS = {
+    "overview": "/Statistics/Overview",
+    "utilization_rate": "/Statistics/Avatar/UtilizationRate",
+    "holding_rate": "/Statistics/Avatar/HoldingRate",
+    "avatar_collocation": "/Statistics/Avatar/AvatarCollocation",
+    "weapon_collocation": "/Statistics/Weapon/WeaponCollocation",
+    "team_combination": "/Statistics/Team/Combination",
+}
+
+
+@dataclass
+class HomaStatistics:
+    """ The "data" payload of every Homa statistics endpoint from one fetch round """
+    overview: dict = None
+    utilization_rate: list = None
+    holding_rate: dict = None
+    avatar_collocation: list = None
+    weapon_collocation: list = None
+    team_combination: list = None
+    fetched_at: float = 0
+    # endpoint name -> error message, for endpoints served from a stale copy or missing
+    errors: dict = field(default_factory=dict)
+
+    @property
+    def schedule_id(self):
+        return self.overview.get("scheduleId") if self.overview else None
+
+
+async def _fetch_endpoint(client: "httpx.AsyncClient", cache: HttpCache, url: str, cached_only: bool,
+                          retries: int, backoff: float):
+    import httpx
+
+    entry = cache.cached(url)
+    if cached_only and entry is not None:
+        return entry["body"], None
+    error = None
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(backoff * 2 ** (attempt - 1))
+        start = time.perf_counter()
+        try:
+            response = await client.get(url, headers=cache.conditional_headers(entry))
+            metrics.HTTP_SECONDS.observe(time.perf_counter() - start, url=url, status=response.status_code)
+            if response.status_code != 304:
+                response.raise_for_status()
+            return cache.record(url, entry, response.status_code, response.headers, response.json)["body"], None
+        except httpx.HTTPStatusError as e:
+            error = e
+            if e.response.status_code < 500 and e.response.status_code != 429:
+                break
+        except httpx.TransportError as e:
+            metrics.HTTP_SECONDS.observe(time.perf_counter() - start, url=url, status="error")
+            error = e
+        except ValueError as e:
+            error = e
+    if entry is None:
+        raise RuntimeError("Unable to fetch %s: %s" % (url, error))
+    return entry["body"], str(error)
+
+
+async def fetch_homa_statistics_async(base_url: str, cache: HttpCache, timeout: float = 10, retries: int = 2,
+                                      backoff: float = 0.5, cached_only: bool = False) -> HomaStatistics:
+    """
+    Request all Homa statistics endpoints concurrently over one shared connection pool.
+
+    Each request is conditional on the cached copy, times out after `timeout` seconds and is retried
+    with exponential backoff on transport errors and 5xx/429 responses. An endpoint that still fails
+    falls back to its cached copy and is listed in HomaStatistics.errors; without a cached copy its
+    field is left as None.
+
+    :param cached_only: use cached copies where available and only request endpoints never fetched before
+    """
+    # Imported on first use to keep it off the startup path
+    import httpx
+
+    async with httpx.AsyncClient(timeout=timeout,
+                                 limits=httpx.Limits(max_connections=len(HOMA_ENDPOINTS))) as client:
+        results = await asyncio.gather(*[
+            _fetch_endpoint(client, cache, base_url + path, cached_only, retries, backoff)
+            for path in HOMA_ENDPOINTS.values()
+        ], return_exceptions=True)
+    statistics = HomaStatistics(fetched_at=time.time())
+    for name, result in zip(HOMA_ENDPOINTS.keys(), results):
+        if isinstance(result, Exception):
+            statistics.errors[name] = str(result)
+            continue
+        payload, error = result
+        setattr(statistics, name, payload.get("data"))
+        if error is not None:
+            statistics.errors[name] = error
+    return statistics
+
+
+def fetch_homa_statistics(base_url: str, cache: HttpCache, **kwargs) -> HomaStatistics:
+    """ Blocking wrapper of fetch_homa_statistics_async for use from worker threads """
+    return asyncio.run(fetch_homa_statistics_async(base_url, cache, **kwargs))
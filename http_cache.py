@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+
+import metrics
+
+
+class HttpCache:
+    """
+    On-disk cache for JSON HTTP sources with conditional revalidation.
+
+    A cached response younger than its TTL is returned directly. An older one is still returned
+    immediately (stale-while-revalidate) while a background request with If-None-Match /
+    If-Modified-Since refreshes it. Only a URL that has never been fetched blocks on the network.
+    """
+
+    def __init__(self, path: str, timeout: float = 10):
+        """
+        :param path: cache directory
+        :param timeout: timeout in seconds of every upstream request
+        """
+        self.path = path
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._entries = {}
+        self._revalidating = set()
+        self._lock = threading.Lock()
+
+    def _file(self, url: str) -> str:
+        return os.path.join(self.path, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json")
+
+    def _load(self, url: str):
+        try:
+            with open(self._file(url), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get("url") == url else None
+
+    def _store(self, entry: dict):
+        os.makedirs(self.path, exist_ok=True)
+        file_path = self._file(entry["url"])
+        # Several processes share the cache directory and thread idents repeat across processes
+        tmp_path = "%s.%d.%d.tmp" % (file_path, os.getpid(), threading.get_ident())
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, file_path)
+
+    def cached(self, url: str):
+        """ Cached entry of url from memory or disk, or None """
+        with self._lock:
+            entry = self._entries.get(url)
+        if entry is None:
+            entry = self._load(url)
+            if entry is not None:
+                with self._lock:
+                    entry = self._entries.setdefault(url, entry)
+        return entry
+
+    def reload(self, url: str):
+        """
+        Entry of url as last stored on disk, e.g. by another process sharing the cache directory, or None.
+        The entry in memory is kept while the stored one is the same response, so its body stays the same object.
+        """
+        entry = self._load(url)
+        with self._lock:
+            current = self._entries.get(url)
+            if entry is None:
+                return current
+            if current is not None and (current["fetched_at"] == entry["fetched_at"] or
+                                        current.get("etag") is not None and current.get("etag") == entry.get("etag")):
+                return current
+            self._entries[url] = entry
+        return entry
+
+    @staticmethod
+    def conditional_headers(entry: dict = None) -> dict:
+        """ If-None-Match / If-Modified-Since headers revalidating a cached entry """
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def record(self, url: str, entry: dict, status_code: int, headers, body) -> dict:
+        """
+        Store the outcome of a (conditional) request made by any HTTP client and return the new entry.
+
+        :param entry: cached entry the request revalidated, or None
+        :param headers: response headers
+        :param body: callable returning the parsed JSON body, only called if the response is not a 304
+        """
+        if status_code == 304 and entry is not None:
+            entry = dict(entry, fetched_at=time.time())
+        else:
+            entry = {
+                "url": url,
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+                "fetched_at": time.time(),
+                "body": body()
+            }
+        self._store(entry)
+        with self._lock:
+            self._entries[url] = entry
+        return entry
+
+    def fetch(self, url: str, entry: dict = None) -> dict:
+        """ Request url (conditionally if a cached entry is given), store and return the new entry """
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, headers=self.conditional_headers(entry), timeout=self.timeout)
+        except requests.RequestException:
+            metrics.HTTP_SECONDS.observe(time.perf_counter() - start, url=url, status="error")
+            raise
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - start, url=url, status=response.status_code)
+        if response.status_code != 304:
+            response.raise_for_status()
+        return self.record(url, entry, response.status_code, response.headers, response.json)
+
+    def _revalidate(self, url: str, entry: dict):
+        try:
+            self.fetch(url, entry)
+        except Exception as e:
+            print("Revalidation of %s failed, serving stale copy: %s" % (url, e))
+        finally:
+            with self._lock:
+                self._revalidating.discard(url)
+
+    def get_json(self, url: str, ttl: float):
+        """
+        JSON body of url, served from cache when possible.
+
+        :param ttl: seconds a cached response is considered fresh
+        """
+        entry = self.cached(url)
+        if entry is None:
+            return self.fetch(url)["body"]
+        if time.time() - entry["fetched_at"] > ttl:
+            with self._lock:
+                start = url not in self._revalidating
+                self._revalidating.add(url)
+            if start:
+                threading.Thread(target=self._revalidate, args=(url, entry), daemon=True).start()
+        return entry["body"]
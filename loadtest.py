@@ -0,0 +1,392 @@
+"""
+Load test of the dashboard callbacks with concurrent simulated visitors.
+
+Every client opens the page like a browser (index, layout, dependencies and the initial callbacks) and then
+repeats interactions - floor change, bin slider move, language switch - posting each callback an interaction
+triggers to /_dash-update-component, chained in dependency order as the Dash renderer does. Throughput and
+p50/p95/p99 latency are reported per callback.
+
+Without --url, a local dashboard is started against a stand-in of the UIGF and Homa APIs:
+
+    python loadtest.py --clients 50 --duration 60 --workers 4 --output loadtest-results.json
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import numpy as np
+
+from benchmark import generate_homa_statistics, git_commit
+from homa import HOMA_ENDPOINTS
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Language codes of the stand-in dictionary, every one abyss.AVAILABLE_LANGUAGES expects
+LOADTEST_LANGUAGES = ("en", "chs", "cht", "de", "es", "fr", "id", "jp", "kr", "pt", "ru", "th", "vi")
+LOADTEST_ITEMS = 90
+# Concurrent connections a browser opens to one host
+BROWSER_CONNECTIONS = 6
+# Interaction name -> component whose value a visitor changes
+INTERACTIONS = {
+    "floor": "floor_radio_control",
+    "bins": "num_bins_slider",
+    "language": "language_dropdown",
+}
+# Callback output -> name of the function serving it in abyss.py
+CALLBACK_NAMES = {
+    "base_figure_store.data": "update_graph",
+    "data_table.sort_by": "update_sorting",
+    "num_bins_store.data": "update_num_bins",
+    "..data_table.data...data_table.page_count..": "update_table_page",
+    "trend_figure_store.data": "update_trend_graph",
+    "uploader_info_frame.src": "update_uploader_frame",
+    "..data_table.columns...data_table.filter_query..": "update_table_columns",
+}
+
+
+class StandInUpstream:
+    """ Local stand-in of the UIGF dictionary and Homa statistics APIs serving fixed synthetic data """
+
+    def __init__(self, seed: int = 0):
+        items = list(range(10000002, 10000002 + LOADTEST_ITEMS))
+        statistics = generate_homa_statistics(items, seed=seed)
+        bodies = {"/dict/genshin/all.json": {lang: {"%s %d" % (lang, item): item for item in items}
+                                             for lang in LOADTEST_LANGUAGES}}
+        for name, path in HOMA_ENDPOINTS.items():
+            bodies[path] = {"retcode": 0, "data": getattr(statistics, name)}
+        self.responses = {}
+        for path, body in bodies.items():
+            raw = json.dumps(body).encode("utf-8")
+            self.responses[path] = (raw, '"%s"' % hashlib.sha1(raw).hexdigest())
+        self._server = None
+
+    def _handler(self):
+        responses = self.responses
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path not in responses:
+                    self.send_error(404)
+                    return
+                raw, etag = responses[self.path]
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(raw)
+
+        return Handler
+
+    def start(self) -> str:
+        """ Serve from a daemon thread; returns the base URL """
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        threading.Thread(target=self._server.serve_forever, name="stand-in-upstream", daemon=True).start()
+        return "http://127.0.0.1:%d" % self._server.server_address[1]
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def wait_until_ready(url: str, process: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Dashboard exited with status %d" % process.returncode)
+        try:
+            if httpx.get(url + "/_dash-dependencies", timeout=5).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("Dashboard not ready after %ss" % timeout)
+
+
+@contextmanager
+def local_dashboard(workdir: str, port: int, workers: int, timeout: float = 120):
+    """ Run abyss.py against a StandInUpstream with its caches in workdir; yields the dashboard URL """
+    upstream = StandInUpstream()
+    upstream_url = upstream.start()
+    env = dict(os.environ, UIGF_API_URL=upstream_url, HOMA_API_URL=upstream_url,
+               HTTP_CACHE_DIR=os.path.join(workdir, "http"),
+               UTILIZATION_HISTORY_DIR=os.path.join(workdir, "utilization_history"),
+               SHARED_DATASET_DIR=os.path.join(workdir, "shared_dataset"),
+               SHARED_METRICS_DIR=os.path.join(workdir, "metrics"),
+               WEB_WORKERS=str(workers), WEB_PORT=str(port))
+    url = "http://127.0.0.1:%d" % port
+    with open(os.path.join(workdir, "abyss.log"), "ab") as log:
+        process = subprocess.Popen([sys.executable, "abyss.py"], cwd=BASE_DIR, env=env, stdout=log,
+                                   stderr=subprocess.STDOUT)
+        try:
+            wait_until_ready(url, process, timeout)
+            yield url
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            upstream.stop()
+
+
+def component_props(layout) -> dict:
+    """ id -> props of every component with an id in a /_dash-layout tree """
+    found = {}
+    stack = [layout]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, dict) and isinstance(node.get("props"), dict):
+            props = node["props"]
+            if isinstance(props.get("id"), str):
+                found[props["id"]] = props
+            stack.extend(value for value in props.values() if isinstance(value, (dict, list)))
+    return found
+
+
+def component_choices(props: dict) -> list:
+    """ Values a visitor can pick in a radio, dropdown or slider component """
+    if "options" in props:
+        return [option["value"] if isinstance(option, dict) else option for option in props["options"]]
+    if "min" in props and "max" in props:
+        return list(range(props["min"], props["max"] + 1, props.get("step") or 1))
+    raise ValueError("Component %s has no known choices" % props.get("id"))
+
+
+class Callback:
+    """ One server-side callback of /_dash-dependencies """
+
+    def __init__(self, dependency: dict):
+        self.output = dependency["output"]
+        self.name = CALLBACK_NAMES.get(self.output, self.output)
+        if self.output.startswith(".."):
+            self.outputs = [tuple(o.rsplit(".", 1)) for o in self.output[2:-2].split("...")]
+        else:
+            self.outputs = [tuple(self.output.rsplit(".", 1))]
+        self.inputs = [(i["id"], i["property"]) for i in dependency["inputs"]]
+        self.state = [(s["id"], s["property"]) for s in dependency["state"]]
+
+    def body(self, values: dict, changed: set) -> dict:
+        """ Request body of this callback, as the Dash renderer posts it """
+        return {
+            "output": self.output,
+            "outputs": [{"id": i, "property": p} for i, p in self.outputs] if len(self.outputs) > 1
+            else {"id": self.outputs[0][0], "property": self.outputs[0][1]},
+            "inputs": [{"id": i, "property": p, "value": values.get((i, p))} for i, p in self.inputs],
+            "changedPropIds": ["%s.%s" % prop for prop in self.inputs if prop in changed],
+            "state": [{"id": i, "property": p, "value": values.get((i, p))} for i, p in self.state],
+        }
+
+
+class LatencyRecorder:
+    """ Client-side latency of every request, by name; only touched from the event loop """
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, name: str, seconds: float, ok: bool):
+        self.latencies.setdefault(name, []).append(seconds)
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self, elapsed: float) -> list:
+        """ Per-name request count, errors, throughput and latency percentiles in milliseconds """
+        rows = []
+        for name, latencies in sorted(self.latencies.items()):
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+            rows.append({"name": name, "requests": len(latencies), "errors": self.errors.get(name, 0),
+                         "per_second": round(len(latencies) / elapsed, 2), "p50_ms": round(p50, 1),
+                         "p95_ms": round(p95, 1), "p99_ms": round(p99, 1),
+                         "max_ms": round(max(latencies) * 1000, 1)})
+        return rows
+
+
+class Visitor:
+    """ One simulated browser session: page load followed by random interactions until the deadline """
+
+    def __init__(self, client: httpx.AsyncClient, recorder: LatencyRecorder, rng: random.Random):
+        self.client = client
+        self.recorder = recorder
+        self.rng = rng
+        self.values = {}
+        self.callbacks = []
+        self.choices = {}
+
+    async def _request(self, name: str, method: str, path: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, **kwargs)
+        except httpx.HTTPError:
+            self.recorder.record(name, time.perf_counter() - start, False)
+            return None
+        self.recorder.record(name, time.perf_counter() - start, response.status_code < 400)
+        return response
+
+    async def load_page(self):
+        await self._request("page.index", "GET", "/")
+        layout = await self._request("page.layout", "GET", "/_dash-layout")
+        dependencies = await self._request("page.dependencies", "GET", "/_dash-dependencies")
+        if layout is None or dependencies is None or layout.status_code != 200 or dependencies.status_code != 200:
+            raise RuntimeError("Unable to load the dashboard page")
+        props = component_props(layout.json())
+        self.values = {(i, p): value for i, component in props.items() for p, value in component.items()}
+        # Clientside callbacks run in the browser and never reach the server
+        self.callbacks = [Callback(d) for d in dependencies.json() if not d.get("clientside_function")]
+        self.choices = {name: component_choices(props[i]) for name, i in INTERACTIONS.items() if i in props}
+        await self.settle({callback: set() for callback in self.callbacks})
+
+    async def _call(self, callback: Callback, changed: set) -> set:
+        response = await self._request(callback.name, "POST", "/_dash-update-component",
+                                       json=callback.body(self.values, changed))
+        if response is None or response.status_code != 200:
+            # 204 is a PreventUpdate / no_update, errors leave the outputs unchanged as well
+            return set()
+        updated = set()
+        for component_id, props in response.json().get("response", {}).items():
+            for prop, value in props.items():
+                self.values[(component_id, prop)] = value
+                updated.add((component_id, prop))
+        return updated
+
+    async def settle(self, pending: dict):
+        """
+        Run the pending callbacks (callback -> changed inputs) and every callback their outputs trigger,
+        in waves of callbacks whose inputs no other pending callback still produces
+        """
+        while pending:
+            produced = {prop: callback for callback in pending for prop in callback.outputs}
+            ready = [callback for callback in pending
+                     if not any(produced.get(prop, callback) is not callback for prop in callback.inputs)]
+            ready = ready or list(pending)
+            results = await asyncio.gather(*[self._call(callback, pending[callback]) for callback in ready])
+            for callback in ready:
+                del pending[callback]
+            updated = set().union(*results)
+            for callback in self.callbacks:
+                triggered = updated.intersection(callback.inputs)
+                if triggered:
+                    pending.setdefault(callback, set()).update(triggered)
+
+    async def interact(self):
+        name = self.rng.choice(sorted(self.choices))
+        component_id = INTERACTIONS[name]
+        current = self.values.get((component_id, "value"))
+        value = self.rng.choice([choice for choice in self.choices[name] if choice != current] or [current])
+        self.values[(component_id, "value")] = value
+        changed = {(component_id, "value")}
+        await self.settle({callback: changed.intersection(callback.inputs) for callback in self.callbacks
+                           if changed.intersection(callback.inputs)})
+
+    async def run(self, deadline: float, think_time: float):
+        await self.load_page()
+        while time.monotonic() < deadline:
+            await self.interact()
+            if think_time > 0:
+                await asyncio.sleep(self.rng.expovariate(1 / think_time))
+
+
+async def run_load(url: str, clients: int, duration: float, think_time: float, ramp_up: float,
+                   timeout: float, seed: int = 0) -> tuple:
+    """ Simulate `clients` concurrent visitors for `duration` seconds; returns (recorder, elapsed seconds) """
+    recorder = LatencyRecorder()
+    limits = httpx.Limits(max_connections=clients * BROWSER_CONNECTIONS,
+                          max_keepalive_connections=clients * BROWSER_CONNECTIONS)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        start = time.monotonic()
+        deadline = start + duration
+
+        async def visit(index: int):
+            # Visitors arrive spread over the ramp-up period
+            await asyncio.sleep(ramp_up * index / clients)
+            try:
+                await Visitor(client, recorder, random.Random(seed * 100003 + index)).run(deadline, think_time)
+            except RuntimeError as e:
+                print("Visitor %d stopped: %s" % (index, e))
+
+        await asyncio.gather(*[visit(index) for index in range(clients)])
+        return recorder, time.monotonic() - start
+
+
+def print_summary(rows: list, elapsed: float):
+    print("%-24s %9s %7s %9s %9s %9s %9s %9s" % ("callback", "requests", "errors", "req/s", "p50 ms", "p95 ms",
+                                                  "p99 ms", "max ms"))
+    for row in rows:
+        print("%-24s %9d %7d %9.2f %9.1f %9.1f %9.1f %9.1f" % (
+            row["name"], row["requests"], row["errors"], row["per_second"], row["p50_ms"], row["p95_ms"],
+            row["p99_ms"], row["max_ms"]))
+    total = sum(row["requests"] for row in rows)
+    print("%d requests in %.1fs, %.2f req/s" % (total, elapsed, total / elapsed))
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="dashboard to test (default: start a local one)")
+    parser.add_argument("--clients", type=int, default=20, help="concurrent simulated visitors")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of interactions per visitor")
+    parser.add_argument("--think-time", type=float, default=1.0,
+                        help="mean seconds between two interactions of a visitor, 0 for none")
+    parser.add_argument("--ramp-up", type=float, default=5, help="seconds over which the visitors arrive")
+    parser.add_argument("--timeout", type=float, default=30, help="timeout of every request in seconds")
+    parser.add_argument("--workers", type=int, default=1, help="WEB_WORKERS of the local dashboard")
+    parser.add_argument("--port", type=int, default=8050, help="port of the local dashboard")
+    parser.add_argument("--workdir", default=None, help="cache directory of the local dashboard (default: temporary)")
+    parser.add_argument("--output", default=None, help="JSON result file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    def run(url: str):
+        return asyncio.run(run_load(url, args.clients, args.duration, args.think_time, args.ramp_up,
+                                    args.timeout, args.seed))
+
+    if args.url:
+        recorder, elapsed = run(args.url.rstrip("/"))
+    else:
+        workdir = args.workdir or tempfile.mkdtemp(prefix="hutao-loadtest-")
+        os.makedirs(workdir, exist_ok=True)
+        with local_dashboard(workdir, args.port, args.workers) as url:
+            recorder, elapsed = run(url)
+    rows = recorder.summary(elapsed)
+    print_summary(rows, elapsed)
+
+    if args.output:
+        report = {
+            "commit": git_commit(),
+            "created_at": time.time(),
+            "url": args.url or "local",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "settings": {"clients": args.clients, "duration": args.duration, "think_time": args.think_time,
+                         "ramp_up": args.ramp_up, "workers": None if args.url else args.workers},
+            "elapsed": round(elapsed, 3),
+            "callbacks": rows,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print("Results written to " + args.output)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,13 +1,24 @@
-import time
 from MysqlConn import MysqlConn
-import json
-import plotly.express as px
-import pandas as pd
-import plotly.io as pio
+from query_cache import QueryCache
+from abyss_statistics import StatisticsQuery
+from artifacts import publish, publish_figure
+from rollups import UploadRollups
+from upload_cache import UploadCache
+from scheduler import ReportScheduler
+import metrics
 from datetime import datetime
-import plotly.graph_objects as go
 import os
-import requests
+import itertools
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+# numpy, pandas and plotly are imported by the jobs that use them, so the process starts without them
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+    import plotly.graph_objects as go
 
 # MySQL Settings
 MYSQL_HOST = os.getenv('MYSQL_HOST')
@@ -15,27 +26,101 @@ MYSQL_PORT = int(os.getenv('MYSQL_PORT', 3306))
 MYSQL_USER = os.getenv('MYSQL_USER')
 MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD')
 MYSQL_DATABASE = os.getenv('MYSQL_DATABASE')
-db = MysqlConn(MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DATABASE)
+MYSQL_POOL_SIZE = int(os.getenv('MYSQL_POOL_SIZE', 4))
+
+# Query result cache: reads that pass a TTL or version probe are served from memory or QUERY_CACHE_DIR
+# ('' for memory only) while their probe is unchanged
+QUERY_CACHE_DIR = os.getenv('QUERY_CACHE_DIR', 'cache/queries')
+QUERY_CACHE_MAX_MB = int(os.getenv('QUERY_CACHE_MAX_MB', 256))
+QUERY_CACHE_DISK_MB = int(os.getenv('QUERY_CACHE_DISK_MB', 1024))
+STATISTICS_CACHE_TTL = int(os.getenv('STATISTICS_CACHE_TTL', 60 * 60))
+query_cache = QueryCache(QUERY_CACHE_MAX_MB * 2 ** 20, path=QUERY_CACHE_DIR or None,
+                         max_disk_bytes=QUERY_CACHE_DISK_MB * 2 ** 20)
+db = MysqlConn(MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DATABASE, pool_size=MYSQL_POOL_SIZE,
+               query_cache=query_cache)
+statistics_query = StatisticsQuery(db, cache_ttl=STATISTICS_CACHE_TTL)
+
+# Upload history: records RIGHT JOIN spiral_abysses, paged on the spiral_abysses primary key
+UPLOAD_COLUMNS = "Uid, UploadTime, Uploader"
+UPLOAD_FROM = "records RIGHT JOIN spiral_abysses ON records.PrimaryId=spiral_abysses.RecordId"
+UPLOAD_KEY = "spiral_abysses.PrimaryId"
+# Version probe of cached reads of the upload history
+UPLOAD_VERSION = "SELECT (SELECT MAX(PrimaryId) FROM records), (SELECT MAX(PrimaryId) FROM spiral_abysses)"
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 100000))
+UPLOAD_READ_WORKERS = int(os.getenv('UPLOAD_READ_WORKERS', 1))
+UPLOAD_CACHE_DIR = os.getenv('UPLOAD_CACHE_DIR', 'cache/uploads')
+UPLOAD_CACHE_REBUILD = os.getenv('UPLOAD_CACHE_REBUILD', '0') == '1'
+# spiral_abysses rows read before their records row was committed are read again with every delta until this
+# many newer rows exist; older ones are taken as orphans
+UPLOAD_JOIN_WINDOW = int(os.getenv('UPLOAD_JOIN_WINDOW', 100000))
+upload_cache = UploadCache(UPLOAD_CACHE_DIR)
+
+# Report scheduling: jobs run in a worker pool, each on its own interval (seconds) or cron expression
+REPORT_WORKERS = int(os.getenv('REPORT_WORKERS', 2))
+REPORT_JITTER = float(os.getenv('REPORT_JITTER', 60))
+UID_LAYOUT_INTERVAL = int(os.getenv('UID_LAYOUT_INTERVAL', 60 * 60 * 6))
+SCHEDULE_BAR_CRON = os.getenv('SCHEDULE_BAR_CRON', '0 */6 * * *')
+# Port of the Prometheus /metrics endpoint, 0 to disable it
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9100))
+
+# Uploader scatter rendering: "exact", "sampled" (capped per trace) or "binned" (UID prefix x time bucket grid)
+UPLOADER_RENDER_MODE = os.getenv('UPLOADER_RENDER_MODE', 'binned')
+UPLOADER_MAX_POINTS = int(os.getenv('UPLOADER_MAX_POINTS', 20000))
+UPLOADER_TIME_BUCKET = os.getenv('UPLOADER_TIME_BUCKET', '1D')
+# Time buckets of the rollup tables: binned reports of these widths are drawn from them
+ROLLUP_GRANULARITY = {"1h": "hourly", "1H": "hourly", "1D": "daily"}
 
-id_to_name_dict = {v: k for k, v in requests.get("https://api.uigf.org/dict/genshin/chs.json").json().items()}
-id_to_name_dict[10000005] = "旅行者"
+# Uploader name -> trace group, trace group -> marker color, region -> leading UID digits
+UPLOADER_GROUP = {
+    "Snap Hutao": "Snap Hutao",
+    "Snap Hutao Bookmark": "Snap Hutao Bookmark",
+    "miao-plugin": "Miao-Plugin",
+    "api-plugin": "Miao-Plugin",
+    "GenshinPizzaHelper": "GenshinPizzaHelper"
+}
+UPLOADER_COLOR = {
+    "Snap Hutao": "rgb(239,85,59)",
+    "Snap Hutao Bookmark": "rgb(0,204,150)",
+    "Miao-Plugin": "rgb(99,110,250)",
+    "GenshinPizzaHelper": "rgb(38, 45, 116)"
+}
+UID_GROUP = {
+    "China": ("1", "2", "3"),
+    "bilibili": "5",
+    "America": "6",
+    "EU": "7",
+    "Asia": "8",
+    "TW/HK/MO": "9"
+}
+UID_GROUP_TITLE = {
+    "China": "Mainland China",
+    "bilibili": "bilibili @ Mainland China",
+    "America": "America",
+    "EU": "Europe",
+    "Asia": "Asia",
+    "TW/HK/MO": "Taiwan/Hong Kong/Macau"
+}
+# Upload count rollup tables in MySQL, updated incrementally from new spiral_abysses rows
+ROLLUP_INTERVAL = int(os.getenv('ROLLUP_INTERVAL', 60 * 15))
+upload_rollups = UploadRollups(db, UID_GROUP)
 
+UPLOADER_RENDER_WORKERS = int(os.getenv('UPLOADER_RENDER_WORKERS', 4))
+UPLOADER_REGION_INDEX = "uploader_regions.json"
 
+
+@metrics.staged("schedule_bar.figure")
 def user_per_schedule_bar():
-    sql = r"SELECT Data FROM `spiral_abysses_statistics` WHERE Name='Overview';"
-    sql_result = db.fetch_all(sql)
-    if sql_result is None:
-        return None
-    else:
-        history_stat = []
-        for schedule in list(sql_result):
-            this_schedule_stat = json.loads(schedule[0])
-            history_stat.append({
-                "ScheduleId": this_schedule_stat["ScheduleId"],
-                "SpiralAbyssTotal": this_schedule_stat["SpiralAbyssTotal"],
-                "SpiralAbyssFullStar": this_schedule_stat["SpiralAbyssFullStar"]
-            })
-    history_stat = history_stat[:6]
+    # plotly.express is slow to import and only needed by this job
+    import plotly.express as px
+
+    history_stat = [{
+        "ScheduleId": stat.schedule_id,
+        "SpiralAbyssTotal": stat.spiral_abyss_total,
+        "SpiralAbyssFullStar": stat.spiral_abyss_full_star
+    } for stat in statistics_query.overview(limit=6)]
+    if not history_stat:
+        # The query error, if any, has been logged; fail the job instead of keeping the old chart silently
+        raise RuntimeError("No Overview statistics in spiral_abysses_statistics")
     fig = px.bar(history_stat, x="ScheduleId", y=["SpiralAbyssTotal", "SpiralAbyssFullStar"],
                  barmode='group', text_auto=True,
                  labels={"ScheduleId": "Schedule Number",
@@ -45,175 +130,265 @@ def user_per_schedule_bar():
                      "SpiralAbyssFullStar": "cornflowerblue"
                  })
     fig.update_layout(title="Recent Six Schedule Abyss Upload Stat", title_x=0.5)
-    pio.write_html(fig, file="assets/output/user_per_schedule_bar.html", auto_open=True, include_plotlyjs="cdn",
-                   include_mathjax="cdn")
+    publish_figure(fig, "user_per_schedule_bar.html", title="Recent Six Schedule Abyss Upload Stat")
+
+
+@metrics.staged("uploads.frame")
+def load_upload_frame(after=None, workers: int = 1, chunks=None, pending: list = None):
+    """
+    Stream the upload history in chunks and reduce each chunk to (UID prefix, time, uploader)
+    before keeping it, so the raw join result is never held in memory as a whole.
+
+    :param after: only read rows whose spiral_abysses primary key is greater than this
+    :param workers: number of connections reading key ranges in parallel
+    :param chunks: reduce these already fetched (PrimaryId, Uid, UploadTime, Uploader) row chunks instead of querying
+    :param pending: spiral_abysses keys up to after that were read without their records row, read again
+    :return: (DataFrame, watermark dict with the highest PrimaryId and UploadTime read and, as Pending, the keys
+        read without a records row within UPLOAD_JOIN_WINDOW of that PrimaryId)
+    :raises Exception: if the read fails part way, so an incomplete result is never cached
+    """
+    import numpy as np
+    import pandas as pd
+
+    frames = []
+    watermark = {"PrimaryId": after if after is not None else 0, "UploadTime": 0}
+    highest_id = watermark["PrimaryId"]
+    unjoined = []
+    if chunks is None:
+        chunks = db.fetch_chunks(UPLOAD_COLUMNS, UPLOAD_FROM, UPLOAD_KEY, chunk_size=UPLOAD_CHUNK_SIZE,
+                                 after=after, workers=workers)
+        if pending:
+            chunks = itertools.chain(chunks, [db.fetch_keys(UPLOAD_COLUMNS, UPLOAD_FROM, UPLOAD_KEY, pending)])
+    for rows in chunks:
+        chunk = pd.DataFrame.from_records(rows, columns=["Id", "UID", "Time", "Uploader"])
+        highest_id = max(highest_id, int(chunk.Id.max()))
+        # Without its records row an upload has no UID yet; the row is read again while its records row
+        # may still be committed
+        missing = chunk.UID.isna()
+        unjoined.extend(chunk.Id[missing].tolist())
+        chunk = chunk[~missing].drop(columns="Id")
+        if chunk.empty:
+            continue
+        watermark["UploadTime"] = max(watermark["UploadTime"], int(chunk.Time.max()))
+        chunk["Time"] = pd.to_datetime(chunk.Time, unit="s")
+        chunk["UID"] = chunk.UID.str.slice(stop=3).astype(np.int16)
+        frames.append(chunk)
+    # Parallel reads yield chunks in completion order, so the highest key seen only bounds a gap-free range
+    # once every key range has finished; a failed read raises before the watermark advances
+    watermark["PrimaryId"] = highest_id
+    watermark["Pending"] = sorted(key for key in unjoined if key > highest_id - UPLOAD_JOIN_WINDOW)
+    if not frames:
+        return pd.DataFrame(columns=["UID", "Time", "Uploader"]), watermark
+    df = pd.concat(frames, ignore_index=True)
+    df["Uploader"] = df.Uploader.astype("category")
+    return df, watermark
+
+
+@metrics.staged("uploads.load")
+def load_upload_history(full_rebuild: bool = False) -> "pd.DataFrame":
+    """
+    Upload history for the reports, served from the local cache plus a delta query for rows newer than
+    the cached watermark. Falls back to a full (parallel) read when the cache is missing or a rebuild is asked for.
+    """
+    import pandas as pd
+
+    cached, watermark = (None, None) if full_rebuild else upload_cache.load()
+    if cached is None:
+        # Only a completed read replaces the cache: load_upload_frame raises if any key range failed
+        df, watermark = load_upload_frame(workers=UPLOAD_READ_WORKERS)
+        upload_cache.replace(df, watermark)
+        print("Rebuilt upload cache with %d rows" % len(df))
+        return df
+    # The delta is read sequentially in key order and appended only once it completed
+    delta, new_watermark = load_upload_frame(after=watermark["PrimaryId"], pending=watermark.get("Pending"))
+    if delta.empty:
+        return cached
+    new_watermark["UploadTime"] = max(new_watermark["UploadTime"], watermark.get("UploadTime", 0))
+    upload_cache.append(delta, new_watermark)
+    print("Fetched %d new upload rows" % len(delta))
+    df = pd.concat([cached, delta], ignore_index=True)
+    df["Uploader"] = df.Uploader.astype("category")
+    return df
+
+
+@metrics.staged("uploads.partition")
+def partition_uploads(df: "pd.DataFrame") -> dict:
+    """
+    Split upload rows into one (UID prefix array, time array) pair per (region, uploader group) in a single
+    vectorized pass: the region is derived once from the first UID digit, the uploader group from the
+    categorical uploader codes, and one groupby on the combined key yields every trace.
+    Every (region, uploader group) combination is present in the result, empty if it has no rows.
+    """
+    import numpy as np
+    import pandas as pd
+
+    groups = list(UPLOADER_COLOR.keys())
+    region_of_digit = np.full(10, -1, dtype=np.int16)
+    for code, prefixes in enumerate(UID_GROUP.values()):
+        region_of_digit[[int(p) for p in prefixes]] = code
+
+    uid = df.UID.to_numpy(dtype=np.int16)
+    upload_time = df.Time.to_numpy(dtype="datetime64[ns]")
+    uploader = df.Uploader.astype("category")
+    # Last entry maps the -1 code of missing uploaders
+    group_of_category = np.array([groups.index(UPLOADER_GROUP[c]) if c in UPLOADER_GROUP else -1
+                                  for c in uploader.cat.categories] + [-1], dtype=np.int16)
+    region = region_of_digit[uid // 100]
+    group = group_of_category[uploader.cat.codes.to_numpy()]
+    key = np.where((region >= 0) & (group >= 0), region * len(groups) + group, -1)
+
+    indices = pd.Series(key).groupby(key, sort=False).indices
+    empty = np.array([], dtype=np.intp)
+    traces = {}
+    for region_code, region_name in enumerate(UID_GROUP.keys()):
+        for group_code, group_name in enumerate(groups):
+            idx = indices.get(region_code * len(groups) + group_code, empty)
+            traces[(region_name, group_name)] = (uid[idx], upload_time[idx])
+    return traces
+
+
+@metrics.staged("uploads.rollups")
+def partition_rollups(rows) -> dict:
+    """
+    Split rollup rows (UID prefix, region, uploader, bucket start, count) into one binned cells frame
+    (UID, Time, Count) per (region, uploader group), summing the uploaders of a group.
+    Every (region, uploader group) combination is present in the result, empty if it has no rows.
+    """
+    import numpy as np
+    import pandas as pd
+
+    df = pd.DataFrame.from_records(list(rows), columns=["UID", "Region", "Uploader", "Time", "Count"])
+    df["Group"] = df.Uploader.map(UPLOADER_GROUP)
+    df["UID"] = df.UID.astype(np.int16)
+    df["Time"] = pd.to_datetime(df.Time, unit="s")
+    df["Count"] = df.Count.astype(np.int64)
+    # Uploaders outside UPLOADER_GROUP have no group and are dropped by the groupby
+    cells = df.groupby(["Region", "Group", "UID", "Time"], sort=False)["Count"].sum().reset_index()
+    frames = {key: frame.drop(columns=["Region", "Group"]).reset_index(drop=True)
+              for key, frame in cells.groupby(["Region", "Group"], sort=False)}
+    empty = pd.DataFrame({"UID": np.array([], dtype=np.int16), "Time": np.array([], dtype="datetime64[ns]"),
+                          "Count": np.array([], dtype=np.int64)})
+    return {(region, group): frames.get((region, group), empty)
+            for region in UID_GROUP.keys() for group in UPLOADER_COLOR.keys()}
+
+
+def bin_uploads(uid: "np.ndarray", upload_time: "np.ndarray") -> "pd.DataFrame":
+    """ Upload count per (UID prefix, UPLOADER_TIME_BUCKET) cell, as a (UID, Time, Count) frame """
+    import pandas as pd
+
+    return pd.DataFrame({"UID": uid, "Time": pd.DatetimeIndex(upload_time).floor(UPLOADER_TIME_BUCKET)}) \
+        .value_counts(sort=False).reset_index(name="Count")
 
 
-def uid_layout():
+def make_binned_trace(cells: "pd.DataFrame", name: str, group: str) -> "go.Scattergl":
+    """ WebGL scatter trace with one marker per (UID prefix, time bucket) cell, sized by its upload count """
+    import numpy as np
+    import plotly.graph_objects as go
+
+    count = cells.Count.to_numpy()
+    marker = dict(color=UPLOADER_COLOR[group], size=4 + 16 * np.sqrt(count / count.max()) if len(count) else 4)
+    return go.Scattergl(x=cells.UID.to_numpy(), y=cells.Time.to_numpy(), marker=marker, customdata=count,
+                        hovertemplate="UID %{x}<br>%{y}<br>%{customdata} uploads", name=name, legendgroup=group,
+                        mode="markers")
+
+
+def make_upload_trace(uid: "np.ndarray", upload_time: "np.ndarray", name: str, group: str,
+                      mode: str = None) -> "go.Scattergl":
+    """
+    WebGL scatter trace for one (region, uploader group), rendered according to mode
+    (UPLOADER_RENDER_MODE by default):
+
+    - exact: one marker per upload
+    - sampled: at most UPLOADER_MAX_POINTS evenly spaced uploads
+    - binned: one marker per (UID prefix, UPLOADER_TIME_BUCKET) cell, sized by its upload count
+    """
+    import numpy as np
+    import plotly.graph_objects as go
+
+    mode = mode or UPLOADER_RENDER_MODE
+    if mode == "binned":
+        return make_binned_trace(bin_uploads(uid, upload_time), name, group)
+    if mode == "sampled" and len(uid) > UPLOADER_MAX_POINTS:
+        idx = np.linspace(0, len(uid) - 1, UPLOADER_MAX_POINTS).astype(np.intp)
+        uid, upload_time = uid[idx], upload_time[idx]
+    return go.Scattergl(x=uid, y=upload_time, marker=dict(color=UPLOADER_COLOR[group]), name=name, legendgroup=group,
+                        mode="markers")
+
+
+def region_artifact_name(region: str) -> str:
+    """ Artifact file name of one region's uploader report, e.g. "uploader_info_tw_hk_mo.html" """
+    return "uploader_info_%s.html" % re.sub(r"[^a-z0-9]+", "_", region.lower()).strip("_")
+
+
+def render_uploader_report(traces: dict, region: str = None) -> str:
+    """
+    Render and publish the uploader report of one region, or the all-region summary if region is None.
+    The summary merges every region into one trace per uploader group and is always binned.
+
+    :param traces: (region, uploader group) -> (UID prefix array, time array) of partition_uploads, or binned
+        cells of partition_rollups
+    """
+    import numpy as np
+    import pandas as pd
+    import plotly.graph_objects as go
+
+    with metrics.stage("uploader_report.figure"):
+        fig = go.Figure()
+        if region is None:
+            for k in UPLOADER_COLOR.keys():
+                parts = [traces[(r, k)] for r in UID_GROUP.keys()]
+                if isinstance(parts[0], pd.DataFrame):
+                    cells = pd.concat(parts).groupby(["UID", "Time"], as_index=False)["Count"].sum()
+                else:
+                    cells = bin_uploads(np.concatenate([uid for uid, _ in parts]),
+                                        np.concatenate([upload_time for _, upload_time in parts]))
+                fig.add_trace(make_binned_trace(cells, name=k, group=k))
+            title, file_name = "Uploader UID Information by Time (All Regions)", "uploader_info.html"
+        else:
+            for k in UPLOADER_COLOR.keys():
+                data = traces[(region, k)]
+                if isinstance(data, pd.DataFrame):
+                    fig.add_trace(make_binned_trace(data, name=f"{k} {region}", group=k))
+                else:
+                    fig.add_trace(make_upload_trace(*data, name=f"{k} {region}", group=k))
+            title, file_name = "Uploader UID Information by Time (%s)" % UID_GROUP_TITLE[region], \
+                region_artifact_name(region)
+        fig.update_layout(showlegend=True, title_text=title, title_x=0.5, yaxis_type="date")
+    return publish_figure(fig, file_name, title=title)
+
+
+def uid_layout(full_rebuild: bool = UPLOAD_CACHE_REBUILD):
     # Option 2
     # Convert SQL result into a dataframe, add charts into trace.
     # Plotly Graph Object (go) is a basic library of Plotly Express (px)
+    # One artifact per region plus an all-region summary, rendered in parallel;
+    # the dashboard only loads the region a visitor selects.
 
-    sql = r"SELECT Uid, UploadTime, Uploader FROM records RIGHT JOIN spiral_abysses ON " \
-          r"records.PrimaryId=spiral_abysses.RecordId"
-    sql_result = db.fetch_all(sql)
-
-    df = pd.DataFrame(list(sql_result))
-    df.rename(columns={0: "UID", 1: "Time", 2: "Uploader"}, inplace=True)
-    df["Time"] = [datetime.fromtimestamp(x) for x in df["Time"]]
-    df.UID = df.UID.str.slice(stop=3).astype(int)
-
-    df_sh = df[df.Uploader == "Snap Hutao"]
-    df_miao = df[df.Uploader.isin(["miao-plugin", "api-plugin"])]
-    df_sh_bm = df[df.Uploader == "Snap Hutao Bookmark"]
-    df_gph = df[df.Uploader == "GenshinPizzaHelper"]
-    df_dict = {
-        "Snap Hutao": df_sh,
-        "Snap Hutao Bookmark": df_sh_bm,
-        "Miao-Plugin": df_miao,
-        "GenshinPizzaHelper": df_gph
-    }
+    granularity = ROLLUP_GRANULARITY.get(UPLOADER_TIME_BUCKET) if UPLOADER_RENDER_MODE == "binned" else None
+    if granularity is not None:
+        # Binned reports only need the upload count of each cell, which the rollup tables already hold
+        upload_rollups.update()
+        rows = upload_rollups.counts(granularity)
+        if not rows:
+            raise RuntimeError("No upload rollups to render")
+        traces = partition_rollups(rows)
+    else:
+        traces = partition_uploads(load_upload_history(full_rebuild))
 
-    uploader_color = {
-        "Snap Hutao": "rgb(239,85,59)",
-        "Snap Hutao Bookmark": "rgb(0,204,150)",
-        "api-plugin": "rgb(99,110,250)",
-        "Miao-plugin": "rgb(99,110,250)",
-        "GenshinPizzaHelper": "rgb(38, 45, 116)"
-    }
-    uid_group = {
-        "China": ("1", "2", "3"),
-        "bilibili": "5",
-        "America": "6",
-        "EU": "7",
-        "Asia": "8",
-        "TW/HK/MO": "9"
-    }
-    fig = go.Figure()
-    for region, uid in uid_group.items():
-        for k, v in df_dict.items():
-            fig.add_trace(
-                go.Scatter(
-                    x=v[v.UID.astype(str).str.startswith(uid)]["UID"],
-                    y=v[v.UID.astype(str).str.startswith(uid)]["Time"],
-                    name=f"{k} {region}",
-                    legendgroup=k,
-                    mode="markers",
-                    marker=dict(color=v[v.UID.astype(str).str.startswith(uid)]["Uploader"].apply(
-                        lambda x: uploader_color[x]))
-                )
-            )
-
-    # Add dropdowns
-    button_layer_1_height = 1.08
-    fig.update_layout(
-        updatemenus=[
-            dict(
-                buttons=list([
-                    dict(
-                        args=[{"visible": [True, True, True,
-                                           True, True, True,
-                                           True, True, True,
-                                           True, True, True,
-                                           True, True, True,
-                                           True, True, True
-                                           ]},
-                              {"title": "Uploader UID Information by Time (All Regions)"}],
-                        label="All",
-                        method="update"
-                    ),
-                    dict(
-                        args=[{"visible": [True, True, True,
-                                           False, False, False,
-                                           False, False, False,
-                                           False, False, False,
-                                           False, False, False,
-                                           False, False, False
-                                           ]},
-                              {"title": "Uploader UID Information by Time (Mainland China)"}],
-                        label="China",
-                        method="update"
-                    ),
-                    dict(
-                        args=[{"visible": [False, False, False,
-                                           True, True, True,
-                                           False, False, False,
-                                           False, False, False,
-                                           False, False, False,
-                                           False, False, False
-                                           ]},
-                              {"title": "Uploader UID Information by Time (bilibili @ Mainland China)"}],
-                        label="bilibili",
-                        method="update"
-                    ),
-                    dict(
-                        args=[{"visible": [False, False, False,
-                                           False, False, False,
-                                           True, True, True,
-                                           False, False, False,
-                                           False, False, False,
-                                           False, False, False
-                                           ]},
-                              {"title": "Uploader UID Information by Time (America)"}],
-                        label="America",
-                        method="update"
-                    ),
-                    dict(
-                        args=[{"visible": [False, False, False,
-                                           False, False, False,
-                                           False, False, False,
-                                           True, True, True,
-                                           False, False, False,
-                                           False, False, False
-                                           ]},
-                              {"title": "Uploader UID Information by Time (Europe)"}],
-                        label="EU",
-                        method="update"
-                    ),
-                    dict(
-                        args=[{"visible": [False, False, False,
-                                           False, False, False,
-                                           False, False, False,
-                                           False, False, False,
-                                           True, True, True,
-                                           False, False, False
-                                           ]},
-                              {"title": "Uploader UID Information by Time (Asia)"}],
-                        label="Asia",
-                        method="update"
-                    ),
-                    dict(
-                        args=[{"visible": [False, False, False,
-                                           False, False, False,
-                                           False, False, False,
-                                           False, False, False,
-                                           False, False, False,
-                                           True, True, True
-                                           ]},
-                              {"title": "Uploader UID Information by Time (Taiwan/Hong Kong/Macau)"}],
-                        label="TW/HK/MO",
-                        method="update"
-                    ),
-                ]
-                ),
-                direction="down",
-                pad={"r": 10, "t": 10},
-                showactive=True,
-                x=0.1,
-                xanchor="left",
-                y=button_layer_1_height,
-                yanchor="top"
-            )
-        ]
-    )
-    fig.update_layout(showlegend=True, title_text="Uploader UID Information by Time",
-                      title_x=0.5)
-    pio.write_html(fig, file="assets/output/uploader_info.html", auto_open=True, include_plotlyjs="cdn",
-                   include_mathjax="cdn")
+    with ThreadPoolExecutor(max_workers=UPLOADER_RENDER_WORKERS) as executor:
+        list(executor.map(lambda region: render_uploader_report(traces, region), [None, *UID_GROUP.keys()]))
+
+    # Region index read by the dashboard to build its region selector
+    regions = [{"label": "All", "title": "All Regions", "file": "uploader_info.html"}] + [
+        {"label": region, "title": UID_GROUP_TITLE[region], "file": region_artifact_name(region)}
+        for region in UID_GROUP.keys()]
+    publish(json.dumps(regions, ensure_ascii=False).encode("utf-8"), UPLOADER_REGION_INDEX)
     print("Successfully generated uploader_info.html")
 
 
 def uid_layout_old():
+    import plotly.express as px
+
     # Option 1
     # This is a straight forward option, good for single chart but too hard for extensions.
     uploader_color = {
@@ -224,7 +399,7 @@ def uid_layout_old():
     }
     sql = r"SELECT Uid, UploadTime, Uploader FROM records RIGHT JOIN spiral_abysses ON " \
           r"records.PrimaryId=spiral_abysses.RecordId"
-    sql_result = db.fetch_all(sql)
+    sql_result = db.fetch_all(sql, version=UPLOAD_VERSION)
 
     # Option 1
     # This is a straight forward option, good for single chart but too hard for extensions.
@@ -237,20 +412,14 @@ def uid_layout_old():
                          "Time": "Datetime"
                      })
 
-    # For UID Group charts
-    uid_group_count = {}
-    for record in china_uid_list:
-        this_uid_group = record["UID"]
-        if this_uid_group not in uid_group_count.keys():
-            uid_group_count[this_uid_group] = 1
-        else:
-            uid_group_count[this_uid_group] += 1
-
     fig.show()
 
 
 if __name__ == "__main__":
-    uid_layout()
-    while True:
-        time.sleep(60 * 60 * 6)
-        uid_layout()
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+    scheduler = ReportScheduler(workers=REPORT_WORKERS)
+    scheduler.add_job("upload_rollups", upload_rollups.update, interval=ROLLUP_INTERVAL)
+    scheduler.add_job("uid_layout", uid_layout, interval=UID_LAYOUT_INTERVAL, jitter=REPORT_JITTER)
+    scheduler.add_job("user_per_schedule_bar", user_per_schedule_bar, cron=SCHEDULE_BAR_CRON, jitter=REPORT_JITTER)
+    scheduler.run_forever()
@@ -0,0 +1,328 @@
+import functools
+import os
+import pickle
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Default histogram buckets in seconds, from a fast query to a multi-minute report job
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = ['%s="%s"' % (name, _escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """ Base of a named metric family with a fixed set of label names """
+    type_name = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels.keys()) != set(self.labelnames):
+            raise ValueError("%s expects labels %s, got %s" % (self.name, self.labelnames, tuple(labels.keys())))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def values(self) -> dict:
+        """ Copy of the current value of every label combination """
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    @staticmethod
+    def combine(a, b):
+        """ Value of one label combination summed over two processes """
+        return a + b
+
+    def samples(self, values: dict = None) -> list:
+        """ [(suffix, label values, extra label, value), ...] of values (default: the current ones) """
+        raise NotImplementedError
+
+    def render(self, values: dict = None) -> str:
+        lines = ["# HELP %s %s" % (self.name, _escape(self.documentation)),
+                 "# TYPE %s %s" % (self.name, self.type_name)]
+        for suffix, values, extra, value in self.samples(values):
+            lines.append("%s%s%s %s" % (self.name, suffix, _format_labels(self.labelnames, values, extra),
+                                        _format_value(value)))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """ Monotonic counter; by convention its name ends in _total """
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self, values: dict = None) -> list:
+        values = self.values() if values is None else values
+        return [("", key, "", value) for key, value in sorted(values.items())]
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_to_current_time(self, **labels):
+        self.set(time.time(), **labels)
+
+    @staticmethod
+    def combine(a, b):
+        # The gauges here are timestamps, so the latest value of any process is the one that counts
+        return max(a, b)
+
+    def samples(self, values: dict = None) -> list:
+        values = self.values() if values is None else values
+        return [("", key, "", value) for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS,
+                 registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """ Observe the duration of a with-block """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def values(self) -> dict:
+        with self._lock:
+            return {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+
+    @staticmethod
+    def combine(a, b):
+        return [x + y for x, y in zip(a[0], b[0])], a[1] + b[1]
+
+    def samples(self, values: dict = None) -> list:
+        values = self.values() if values is None else values
+        items = sorted((key, counts, total) for key, (counts, total) in values.items())
+        result = []
+        for key, counts, total in items:
+            for bound, count in zip(self.buckets, counts):
+                result.append(("_bucket", key, 'le="%s"' % _format_value(bound), count))
+            result.append(("_sum", key, "", total))
+            result.append(("_count", key, "", counts[-1]))
+        return result
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric):
+        with self._lock:
+            if any(m.name == metric.name for m in self._metrics):
+                raise ValueError("Metric %s is already registered" % metric.name)
+            self._metrics.append(metric)
+
+    def metrics(self) -> list:
+        with self._lock:
+            return list(self._metrics)
+
+    def render(self, values: dict = None) -> str:
+        """
+        All metrics in the Prometheus text exposition format
+
+        :param values: {metric name: values} to render instead of the current values, see SharedMetrics
+        """
+        return "\n".join(metric.render(None if values is None else values.get(metric.name, {}))
+                         for metric in self.metrics()) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class SharedMetrics:
+    """
+    Metrics of several processes of one server (web workers and their refresher) served as one scrape target.
+
+    Every process calls start() after it is forked and then writes its values to path/<pid>.pickle every
+    interval seconds; render() of any process sums the files of all of them, so a scrape answered by any
+    worker sees every process and counters never go backwards. Files of exited processes are kept, their
+    counts still belong to the totals; clear() removes them when the server starts.
+    """
+
+    def __init__(self, path: str, interval: float = 5, registry: Registry = None):
+        self.path = path
+        self.interval = interval
+        self.registry = registry if registry is not None else REGISTRY
+        self._stop = threading.Event()
+
+    def clear(self):
+        """ Remove the files of previous runs; call once in the parent process before forking """
+        if os.path.isdir(self.path):
+            for file_name in os.listdir(self.path):
+                if file_name.endswith(".pickle"):
+                    os.remove(os.path.join(self.path, file_name))
+
+    def start(self):
+        """
+        Start sharing the values of this process. Values it inherited from the parent process at fork are
+        dropped first, as the parent's own file (if any) already counts them.
+        """
+        for metric in self.registry.metrics():
+            metric.reset()
+        os.makedirs(self.path, exist_ok=True)
+        self.write()
+        threading.Thread(target=self._run, name="shared-metrics", daemon=True).start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                print("Unable to write shared metrics: " + str(e))
+
+    def write(self):
+        """ Write the current values of this process """
+        file_path = os.path.join(self.path, "%d.pickle" % os.getpid())
+        tmp_path = "%s.%d.tmp" % (file_path, threading.get_ident())
+        with open(tmp_path, "wb") as f:
+            pickle.dump({metric.name: metric.values() for metric in self.registry.metrics()}, f)
+        os.replace(tmp_path, file_path)
+
+    def render(self) -> str:
+        """ Metrics of all processes, with fresh values of this one """
+        self.write()
+        combined = {metric.name: {} for metric in self.registry.metrics()}
+        combine = {metric.name: metric.combine for metric in self.registry.metrics()}
+        for file_name in sorted(os.listdir(self.path)):
+            if not file_name.endswith(".pickle"):
+                continue
+            try:
+                with open(os.path.join(self.path, file_name), "rb") as f:
+                    process_values = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                continue
+            for name, values in process_values.items():
+                if name not in combined:
+                    continue
+                for key, value in values.items():
+                    current = combined[name].get(key)
+                    combined[name][key] = value if current is None else combine[name](current, value)
+        return self.registry.render(combined)
+
+    def stop(self):
+        self._stop.set()
+
+
+STAGE_SECONDS = Histogram("stage_duration_seconds", "Duration of pipeline stages", ("stage",))
+STAGE_FAILURES = Counter("stage_failures_total", "Pipeline stages that raised", ("stage",))
+STAGE_LAST_SUCCESS = Gauge("stage_last_success_timestamp_seconds", "Unix time a stage last succeeded", ("stage",))
+SQL_SECONDS = Histogram("sql_query_duration_seconds", "Duration of SQL statements", ("operation",))
+SQL_ROWS = Counter("sql_rows_total", "Rows returned or affected by SQL statements", ("operation",))
+SQL_ERRORS = Counter("sql_errors_total", "SQL statements that failed", ("operation",))
+QUERY_CACHE_REQUESTS = Counter("sql_query_cache_requests_total", "Cached SQL reads by result (memory, disk or miss)",
+                               ("operation", "result"))
+HTTP_SECONDS = Histogram("http_request_duration_seconds", "Duration of upstream HTTP requests", ("url", "status"))
+CALLBACK_SECONDS = Histogram("dash_callback_duration_seconds", "Server-side latency of Dash callbacks",
+                             ("output", "status"))
+JOB_SECONDS = Histogram("report_job_duration_seconds", "Duration of scheduled report jobs", ("job",))
+JOB_FAILURES = Counter("report_job_failures_total", "Scheduled report jobs that raised", ("job",))
+JOB_SKIPPED = Counter("report_job_skipped_total", "Scheduled runs skipped because the job was still running",
+                      ("job",))
+JOB_LAST_SUCCESS = Gauge("report_job_last_success_timestamp_seconds", "Unix time a report job last succeeded",
+                         ("job",))
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a pipeline stage: its duration, failure count and last success time are recorded under `name`
+
+    with metrics.stage("uid_layout.render"):
+        ...
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_FAILURES.inc(stage=name)
+        raise
+    else:
+        STAGE_LAST_SUCCESS.set_to_current_time(stage=name)
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
+
+
+def staged(name: str):
+    """ Decorator form of stage() """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """ Serve /metrics from a daemon thread, for processes without a web server of their own """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
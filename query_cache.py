@@ -0,0 +1,179 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueryCache:
+    """
+    Result cache of SQL reads keyed by operation, SQL and parameters.
+
+    An entry is reused while it is younger than the TTL of the read and, for reads with a version probe,
+    while the probe (a cheap query such as MAX(PrimaryId)) still returns the row it returned when the entry
+    was stored. Entries are kept in memory up to max_bytes, least recently used first out, and optionally
+    also pickled to a directory so they survive restarts of the report generator. The directory is bounded
+    the same way by max_disk_bytes, using the file modification time, which a read from disk refreshes.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 2 ** 20, path: str = None, probe_ttl: float = 1,
+                 max_disk_bytes: int = 1024 * 2 ** 20):
+        """
+        :param max_bytes: memory bound (pickled size) of all entries; larger results are only kept on disk
+        :param path: directory of the on-disk tier, None to keep entries in memory only
+        :param probe_ttl: seconds a version probe result is reused before the probe runs again
+        :param max_disk_bytes: size bound of the on-disk tier
+        """
+        self.max_bytes = max_bytes
+        self.path = path
+        self.probe_ttl = probe_ttl
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()  # key -> (stored_at, version, result, size), least recently used first
+        self._bytes = 0
+        self._disk_bytes = None  # estimate of the on-disk tier size, None until the directory was scanned
+        self._probes = {}  # probe SQL -> (checked_at, version)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(operation: str, sql: str, params=None) -> str:
+        if isinstance(params, list):
+            params = tuple(params)
+        elif isinstance(params, dict):
+            params = tuple(sorted(params.items()))
+        return hashlib.sha1(repr((operation, sql, params)).encode("utf-8")).hexdigest()
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key + ".pickle")
+
+    def _load(self, key: str):
+        try:
+            with open(self._file(key), "rb") as f:
+                data = f.read()
+            entry = pickle.loads(data) + (len(data),)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError):
+            return None
+        try:
+            # Recently read entries are evicted last
+            os.utime(self._file(key))
+        except OSError:
+            pass
+        return entry
+
+    def _store(self, key: str, data: bytes):
+        os.makedirs(self.path, exist_ok=True)
+        file_path = self._file(key)
+        tmp_path = "%s.%d.tmp" % (file_path, threading.get_ident())
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, file_path)
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += len(data)
+            evict = self._disk_bytes is None or self._disk_bytes > self.max_disk_bytes
+        if evict:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        """
+        Remove the least recently used files until the on-disk tier is down to 90% of max_disk_bytes.
+        The directory is only scanned when the running estimate exceeds the bound (or is unknown), and
+        the scan corrects the estimate for files written or removed by other processes.
+        """
+        files = []
+        for file_name in os.listdir(self.path):
+            if file_name.endswith(".pickle"):
+                try:
+                    stat = os.stat(os.path.join(self.path, file_name))
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, file_name))
+        total = sum(size for _, size, _ in files)
+        if total > self.max_disk_bytes:
+            files.sort()
+            for _, size, file_name in files:
+                if total <= self.max_disk_bytes * 0.9:
+                    break
+                try:
+                    os.remove(os.path.join(self.path, file_name))
+                except OSError:
+                    pass
+                total -= size
+        with self._lock:
+            self._disk_bytes = total
+
+    def _remember(self, key: str, entry: tuple):
+        """ Put an entry into the memory tier and evict least recently used ones beyond max_bytes """
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[3]
+            if entry[3] > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self._bytes += entry[3]
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[3]
+
+    def get(self, key: str, ttl: float = None, version=None):
+        """
+        (tier, result) of a valid entry, tier being "memory" or "disk", or None
+
+        :param ttl: maximum age in seconds, None for no limit
+        :param version: current version probe result, None if the read has no probe
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        tier = "memory"
+        if entry is None and self.path is not None:
+            entry, tier = self._load(key), "disk"
+        if entry is None:
+            return None
+        stored_at, stored_version, result, _ = entry
+        if (ttl is not None and time.time() - stored_at > ttl) or stored_version != version:
+            return None
+        if tier == "disk":
+            self._remember(key, entry)
+        return tier, result
+
+    def put(self, key: str, result, version=None):
+        """ Store the result of a read together with the version probe result it was read at """
+        stored_at = time.time()
+        # The pickled size doubles as the memory accounting of the entry
+        data = pickle.dumps((stored_at, version, result), protocol=pickle.HIGHEST_PROTOCOL)
+        self._remember(key, (stored_at, version, result, len(data)))
+        if self.path is not None:
+            self._store(key, data)
+
+    def probe(self, sql: str, run):
+        """ Version of a probe query, running it with run(sql) unless it ran within probe_ttl seconds """
+        now = time.monotonic()
+        with self._lock:
+            checked = self._probes.get(sql)
+        if checked is not None and now - checked[0] <= self.probe_ttl:
+            return checked[1]
+        version = run(sql)
+        with self._lock:
+            self._probes[sql] = (now, version)
+        return version
+
+    def clear(self):
+        """ Drop every entry from memory and disk """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._probes.clear()
+        if self.path is not None and os.path.isdir(self.path):
+            for file_name in os.listdir(self.path):
+                if file_name.endswith(".pickle"):
+                    os.remove(os.path.join(self.path, file_name))
+        with self._lock:
+            self._disk_bytes = None
+
+    def stats(self) -> dict:
+        """ Number of entries and pickled bytes held in memory, and the estimated size of the on-disk tier """
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "disk_bytes": self._disk_bytes}
@@ -0,0 +1,146 @@
+from MysqlConn import MysqlConn
+
+ROLLUP_SOURCE = "records RIGHT JOIN spiral_abysses ON records.PrimaryId=spiral_abysses.RecordId"
+ROLLUP_KEY = "spiral_abysses.PrimaryId"
+ROLLUP_STATE_TABLE = "upload_rollup_state"
+# spiral_abysses rows past the watermark whose records row was not committed yet, counted once it is
+ROLLUP_PENDING_TABLE = "upload_rollup_pending"
+ROLLUP_PENDING_SOURCE = "`%s` JOIN spiral_abysses ON spiral_abysses.PrimaryId=`%s`.PrimaryId " \
+                        "JOIN records ON records.PrimaryId=spiral_abysses.RecordId" % ((ROLLUP_PENDING_TABLE,) * 2)
+# Version probe of cached rollup reads: an update either advances the watermark or counts pending rows,
+# which removes them
+ROLLUP_VERSION = "SELECT Watermark, (SELECT COUNT(*) FROM `%s`) FROM `%s` WHERE Name='uploads'" % (
+    ROLLUP_PENDING_TABLE, ROLLUP_STATE_TABLE)
+# Rollup table -> bucket width in seconds
+ROLLUP_TABLES = {
+    "upload_rollup_hourly": 60 * 60,
+    "upload_rollup_daily": 60 * 60 * 24,
+}
+
+
+class UploadRollups:
+    """
+    Upload counts per (UID prefix, region, uploader, time bucket), materialized in MySQL.
+
+    Each update aggregates only the spiral_abysses rows past the stored watermark inside MySQL and
+    adds them to the rollup tables with INSERT ... ON DUPLICATE KEY UPDATE, in the same transaction
+    that advances the watermark, so every upload is counted exactly once. A row whose records row is not
+    committed yet when the watermark passes it is kept in a pending table and counted by a later update,
+    unless it is still unmatched once join_window newer rows exist.
+    """
+
+    def __init__(self, db: MysqlConn, uid_group: dict, batch_size: int = 500000, join_window: int = 100000):
+        """
+        :param uid_group: region name -> leading UID digit(s), as used by the reports
+        :param batch_size: maximum number of spiral_abysses keys aggregated per transaction
+        :param join_window: number of newer spiral_abysses rows after which a row without a records row is
+            taken as orphaned and no longer retried
+        """
+        self.db = db
+        self.batch_size = batch_size
+        self.join_window = join_window
+        cases = " ".join("WHEN '%s' THEN '%s'" % (digit, region)
+                         for region, digits in uid_group.items() for digit in tuple(digits))
+        self._region_sql = "CASE LEFT(Uid, 1) %s ELSE 'Other' END" % cases
+
+    def ensure_tables(self):
+        for table in ROLLUP_TABLES.keys():
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS `%s` ("
+                "UidPrefix SMALLINT NOT NULL, "
+                "Region VARCHAR(16) NOT NULL, "
+                "Uploader VARCHAR(64) NOT NULL, "
+                "BucketStart BIGINT NOT NULL, "
+                "UploadCount INT NOT NULL, "
+                "PRIMARY KEY (UidPrefix, Uploader, BucketStart), "
+                "KEY idx_region_bucket (Region, BucketStart))" % table)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS `%s` (Name VARCHAR(64) PRIMARY KEY, Watermark BIGINT NOT NULL)"
+            % ROLLUP_STATE_TABLE)
+        self.db.execute("INSERT IGNORE INTO `%s` (Name, Watermark) VALUES ('uploads', 0)" % ROLLUP_STATE_TABLE)
+        self.db.execute("CREATE TABLE IF NOT EXISTS `%s` (PrimaryId BIGINT PRIMARY KEY, Joined BOOL NOT NULL DEFAULT 0)"
+                        % ROLLUP_PENDING_TABLE)
+
+    def _aggregate(self, cursor, from_clause: str, condition: str, params: tuple):
+        """ Add the uploads of the matching joined rows to every rollup table """
+        for table, width in ROLLUP_TABLES.items():
+            cursor.execute(
+                "INSERT INTO `%s` (UidPrefix, Region, Uploader, BucketStart, UploadCount) "
+                "SELECT CAST(LEFT(Uid, 3) AS UNSIGNED), %s, Uploader, "
+                "UploadTime DIV %d * %d AS Bucket, COUNT(*) AS Uploads "
+                "FROM %s WHERE %s AND Uid IS NOT NULL "
+                "GROUP BY 1, 2, 3, 4 "
+                "ON DUPLICATE KEY UPDATE UploadCount = UploadCount + VALUES(UploadCount)"
+                % (table, self._region_sql, width, width, from_clause, condition), params)
+
+    def _update_pending(self, high_key: int):
+        """ Count the pending rows whose records row has been committed since, and drop orphaned ones """
+        with self.db.transaction() as cursor:
+            # Serializes concurrent updates like _update_batch
+            cursor.execute("SELECT Watermark FROM `%s` WHERE Name='uploads' FOR UPDATE" % ROLLUP_STATE_TABLE)
+            # Marked first, so a records row committed while this runs is neither counted nor dropped
+            cursor.execute("UPDATE %s SET `%s`.Joined=1" % (ROLLUP_PENDING_SOURCE, ROLLUP_PENDING_TABLE))
+            self._aggregate(cursor, ROLLUP_PENDING_SOURCE, "`%s`.Joined=1" % ROLLUP_PENDING_TABLE, ())
+            cursor.execute("DELETE FROM `%s` WHERE Joined=1 OR PrimaryId <= %%s" % ROLLUP_PENDING_TABLE,
+                           (high_key - self.join_window,))
+
+    def _update_batch(self, high_key: int) -> int:
+        """ Aggregate one batch of new rows; returns the new watermark """
+        with self.db.transaction() as cursor:
+            cursor.execute("SELECT Watermark FROM `%s` WHERE Name='uploads' FOR UPDATE" % ROLLUP_STATE_TABLE)
+            low = cursor.fetchone()[0]
+            high = min(low + self.batch_size, high_key)
+            if high > low:
+                # Recent rows without a records row are set aside first; one committed after that is
+                # skipped here and counted from the pending table instead
+                cursor.execute("INSERT IGNORE INTO `%s` (PrimaryId) SELECT %s FROM %s "
+                               "WHERE %s > %%s AND %s <= %%s AND records.PrimaryId IS NULL"
+                               % (ROLLUP_PENDING_TABLE, ROLLUP_KEY, ROLLUP_SOURCE, ROLLUP_KEY, ROLLUP_KEY),
+                               (max(low, high_key - self.join_window), high))
+                self._aggregate(cursor, ROLLUP_SOURCE,
+                                "%s > %%s AND %s <= %%s AND %s NOT IN (SELECT PrimaryId FROM `%s`)"
+                                % (ROLLUP_KEY, ROLLUP_KEY, ROLLUP_KEY, ROLLUP_PENDING_TABLE), (low, high))
+                cursor.execute("UPDATE `%s` SET Watermark=%%s WHERE Name='uploads'" % ROLLUP_STATE_TABLE, (high,))
+        return max(low, high)
+
+    def update(self) -> int:
+        """ Fold all new upload rows into the rollup tables; returns the watermark reached """
+        self.ensure_tables()
+        high_key = self.db.key_range("spiral_abysses", "PrimaryId")[1]
+        if high_key is None:
+            return 0
+        self._update_pending(high_key)
+        while True:
+            watermark = self._update_batch(high_key)
+            if watermark >= high_key:
+                return watermark
+
+    def rebuild(self) -> int:
+        """ Recompute all rollups from scratch """
+        self.ensure_tables()
+        for table in ROLLUP_TABLES.keys():
+            self.db.execute("TRUNCATE TABLE `%s`" % table)
+        self.db.execute("TRUNCATE TABLE `%s`" % ROLLUP_PENDING_TABLE)
+        self.db.execute("UPDATE `%s` SET Watermark=0 WHERE Name='uploads'" % ROLLUP_STATE_TABLE)
+        return self.update()
+
+    def counts(self, granularity: str = "daily", region: str = None, since: int = None):
+        """
+        Upload counts as (UidPrefix, Region, Uploader, BucketStart, UploadCount) rows
+
+        :param granularity: "hourly" or "daily"
+        :param region: only this region
+        :param since: only buckets starting at or after this Unix timestamp
+        """
+        table = "upload_rollup_%s" % granularity
+        if table not in ROLLUP_TABLES:
+            raise ValueError("Unknown rollup granularity: %s" % granularity)
+        sql = "SELECT UidPrefix, Region, Uploader, BucketStart, UploadCount FROM `%s` WHERE 1=1" % table
+        params = []
+        if region is not None:
+            sql += " AND Region=%s"
+            params.append(region)
+        if since is not None:
+            sql += " AND BucketStart>=%s"
+            params.append(since)
+        return self.db.fetch_all(sql + " ORDER BY BucketStart", params, version=ROLLUP_VERSION)
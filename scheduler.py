@@ -0,0 +1,204 @@
+import random
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable
+
+import metrics
+
+
+class CronExpression:
+    """
+    Standard five-field cron expression (minute hour day-of-month month day-of-week),
+    supporting "*", "a-b", "*/n", "a-b/n" and comma separated lists. Day of week 0 and 7 are Sunday.
+    """
+    FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression: str):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError("Cron expression must have 5 fields: %r" % expression)
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = [
+            self._parse_field(part, low, high) for part, (low, high) in zip(parts, self.FIELD_RANGES)]
+        if 7 in self.weekdays:
+            self.weekdays = (self.weekdays - {7}) | {0}
+        # As in cron, a restricted day-of-month and day-of-week match if either of them matches
+        self.any_day = parts[2] == "*"
+        self.any_weekday = parts[4] == "*"
+
+    @staticmethod
+    def _parse_field(field_value: str, low: int, high: int) -> set:
+        values = set()
+        for item in field_value.split(","):
+            value_range, _, step = item.partition("/")
+            if value_range == "*":
+                start, end = low, high
+            elif "-" in value_range:
+                start, end = (int(v) for v in value_range.split("-", 1))
+            else:
+                start = int(value_range)
+                end = high if step else start
+            if not low <= start <= end <= high:
+                raise ValueError("Cron field %r out of range %d-%d" % (field_value, low, high))
+            values.update(range(start, end + 1, int(step) if step else 1))
+        return values
+
+    def _day_matches(self, dt: datetime) -> bool:
+        day_match = dt.day in self.days
+        weekday_match = (dt.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day_match and weekday_match
+        return day_match or weekday_match
+
+    def next_after(self, timestamp: float) -> float:
+        """ Timestamp of the first matching minute strictly after timestamp (local time) """
+        dt = datetime.fromtimestamp(timestamp).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=366 * 5)
+        while dt < limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self._day_matches(dt):
+                dt = (dt + timedelta(days=1)).replace(hour=0, minute=0)
+            elif dt.hour not in self.hours:
+                dt = (dt + timedelta(hours=1)).replace(minute=0)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return dt.timestamp()
+        raise ValueError("Cron expression %r never matches" % self.expression)
+
+
+@dataclass
+class Job:
+    name: str
+    func: Callable[[], None]
+    interval: float = None
+    cron: CronExpression = None
+    jitter: float = 0
+    next_run: float = 0
+    running: bool = False
+    runs: int = 0
+    failures: int = 0
+    skipped: int = 0
+    last_run: float = None
+    last_duration: float = None
+    last_success: float = None
+    last_error: str = None
+    args: tuple = field(default_factory=tuple)
+
+    def schedule_next(self, now: float):
+        base = self.cron.next_after(now) if self.cron is not None else now + self.interval
+        self.next_run = base + random.uniform(0, self.jitter)
+
+
+class ReportScheduler:
+    """
+    Runs registered report jobs on their own interval or cron schedule in a worker pool.
+    A job that is still running when it is due again is skipped for that slot, so a slow job
+    never overlaps itself or delays the other jobs.
+    """
+
+    def __init__(self, workers: int = 2):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+
+    def add_job(self, name: str, func: Callable, interval: float = None, cron: str = None, jitter: float = 0,
+                run_at_start: bool = True, args: tuple = ()):
+        """
+        Register a job; exactly one of interval (seconds) and cron must be given.
+
+        :param jitter: random delay of up to this many seconds added to every scheduled run
+        :param run_at_start: run the job as soon as the scheduler starts instead of waiting for its first slot
+        """
+        if (interval is None) == (cron is None):
+            raise ValueError("Job %s needs either an interval or a cron expression" % name)
+        job = Job(name, func, interval=interval, cron=CronExpression(cron) if cron else None, jitter=jitter,
+                  args=args)
+        if run_at_start:
+            job.next_run = time.time()
+        else:
+            job.schedule_next(time.time())
+        with self._lock:
+            self._jobs[name] = job
+        self._wakeup.set()
+        return job
+
+    def status(self) -> dict:
+        """ Per-job run statistics """
+        with self._lock:
+            return {name: {
+                "running": job.running,
+                "runs": job.runs,
+                "failures": job.failures,
+                "skipped": job.skipped,
+                "last_run": job.last_run,
+                "last_duration": job.last_duration,
+                "last_success": job.last_success,
+                "last_error": job.last_error,
+                "next_run": job.next_run
+            } for name, job in self._jobs.items()}
+
+    def _run_job(self, job: Job):
+        start = time.time()
+        error = None
+        try:
+            job.func(*job.args)
+        except Exception:
+            error = traceback.format_exc()
+        duration = time.time() - start
+        metrics.JOB_SECONDS.observe(duration, job=job.name)
+        if error is None:
+            metrics.JOB_LAST_SUCCESS.set(start + duration, job=job.name)
+        else:
+            metrics.JOB_FAILURES.inc(job=job.name)
+        with self._lock:
+            job.running = False
+            job.runs += 1
+            job.last_run = start
+            job.last_duration = duration
+            if error is None:
+                job.last_success = start
+                job.last_error = None
+            else:
+                job.failures += 1
+                job.last_error = error
+        if error is None:
+            print("Job %s finished in %.1fs" % (job.name, duration))
+        else:
+            print("Job %s failed after %.1fs:\n%s" % (job.name, duration, error))
+
+    def run_pending(self) -> float:
+        """ Submit all due jobs; returns the timestamp of the next scheduled run """
+        now = time.time()
+        with self._lock:
+            for job in self._jobs.values():
+                if job.next_run > now:
+                    continue
+                if job.running:
+                    job.skipped += 1
+                    metrics.JOB_SKIPPED.inc(job=job.name)
+                    print("Job %s is still running, skipping this run" % job.name)
+                else:
+                    job.running = True
+                    self._executor.submit(self._run_job, job)
+                job.schedule_next(now)
+            return min((job.next_run for job in self._jobs.values()), default=now + 60)
+
+    def run_forever(self):
+        """ Block and run jobs until stop() is called """
+        while not self._stopped:
+            next_run = self.run_pending()
+            self._wakeup.wait(max(0.0, min(next_run - time.time(), 60)))
+            self._wakeup.clear()
+
+    def stop(self, wait: bool = True):
+        self._stopped = True
+        self._wakeup.set()
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,162 @@
+import json
+import os
+import threading
+import time
+import traceback
+from typing import TYPE_CHECKING, Callable
+
+from data_refresher import DataSnapshot
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+CURRENT_FILE = "current.json"
+
+
+class SharedDataset:
+    """
+    Publishes versions of a DataFrame as uncompressed Arrow IPC (Feather v2) files that any number of
+    processes can memory-map. Each version is written to its own file; current.json is then switched to
+    it atomically, so readers never see a partially written dataset.
+    """
+
+    def __init__(self, path: str, keep: int = 3):
+        """
+        :param path: directory shared by the writer and the readers
+        :param keep: number of versions kept on disk, so a reader mapping an older one is not cut off
+        """
+        self.path = path
+        self.keep = keep
+
+    def current(self):
+        """ (version, file name, published_at) of the current version, or None """
+        try:
+            with open(os.path.join(self.path, CURRENT_FILE), "r", encoding="utf-8") as f:
+                current = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return current["version"], current["file"], current["published_at"]
+
+    def publish(self, df: "pd.DataFrame") -> int:
+        """ Write df as the next version and make it current; returns the new version """
+        import pyarrow as pa
+
+        os.makedirs(self.path, exist_ok=True)
+        current = self.current()
+        version = current[0] + 1 if current is not None else 1
+        file_name = "dataset-%d.arrow" % version
+        # Numeric columns keep NaN as a value rather than becoming nullable, so readers can map them zero-copy
+        table = pa.table({str(column): pa.array(values.to_numpy()) if values.dtype.kind in "iufb"
+                          else pa.array(values, from_pandas=True) for column, values in df.items()})
+        tmp_path = os.path.join(self.path, "." + file_name + ".tmp")
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, os.path.join(self.path, file_name))
+
+        tmp_path = os.path.join(self.path, "." + CURRENT_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": version, "file": file_name, "published_at": time.time()}, f)
+        os.replace(tmp_path, os.path.join(self.path, CURRENT_FILE))
+
+        for old_version in range(version - self.keep, 0, -1):
+            old_path = os.path.join(self.path, "dataset-%d.arrow" % old_version)
+            if not os.path.exists(old_path):
+                break
+            # Processes that still map the file keep their pages until they switch versions
+            os.remove(old_path)
+        return version
+
+
+class SharedDatasetReader:
+    """
+    Read side of a SharedDataset with the snapshot interface of DataRefresher (get / on_refresh).
+
+    The current version is memory-mapped, so its column buffers live in the page cache and are shared
+    by every process reading it. The first get() loads the current version; after start(), a background
+    thread checks current.json every check_interval seconds and loads a new version off the request path.
+    The listeners run on the new snapshot before get() returns it, so requests keep being served from the
+    previous snapshot while the caches of the new one are built.
+    """
+
+    def __init__(self, path: str, check_interval: float = 1, wait_timeout: float = 120):
+        """
+        :param wait_timeout: seconds the first get() waits for a first version to be published
+        """
+        self.dataset = SharedDataset(path)
+        self.check_interval = check_interval
+        self.wait_timeout = wait_timeout
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._thread = None
+
+    def on_refresh(self, listener: Callable[[DataSnapshot], None]):
+        """ Register a function called with every newly loaded snapshot """
+        self._listeners.append(listener)
+
+    def _load(self, current) -> DataSnapshot:
+        import pyarrow as pa
+
+        version, file_name, published_at = current
+        source = pa.memory_map(os.path.join(self.dataset.path, file_name), "r")
+        table = pa.ipc.open_file(source).read_all()
+        # split_blocks keeps null-free numeric columns as zero-copy views of the mapped buffers
+        return DataSnapshot(version, table.to_pandas(split_blocks=True), published_at)
+
+    def _check(self):
+        """
+        Load a newly published version, run the listeners on it and only then make it current. Checks are
+        serialized by the lock; get() only takes it while there is no snapshot yet.
+        """
+        with self._lock:
+            current = self.dataset.current()
+            if current is None or (self._snapshot is not None and current[0] == self._snapshot.version):
+                return
+            snapshot = self._load(current)
+            for listener in self._listeners:
+                try:
+                    listener(snapshot)
+                except Exception:
+                    print("Shared dataset listener %s failed:\n%s" % (getattr(listener, "__name__", listener),
+                                                                      traceback.format_exc()))
+            self._snapshot = snapshot
+
+    def _run(self):
+        import pyarrow as pa
+
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                self._check()
+            except (OSError, pa.ArrowException) as e:
+                print("Unable to load shared dataset: " + str(e))
+
+    def start(self):
+        """
+        Check for new versions in a daemon thread. Threads do not survive a fork, so a preforking server
+        calls this in every worker process.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="shared-dataset-reader", daemon=True)
+            self._thread.start()
+
+    def get(self) -> DataSnapshot:
+        """ Current snapshot; the first call loads it, waiting up to wait_timeout for a first version """
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+        import pyarrow as pa
+
+        deadline = time.monotonic() + self.wait_timeout
+        while self._snapshot is None:
+            try:
+                self._check()
+            except (OSError, pa.ArrowException) as e:
+                print("Unable to load shared dataset: " + str(e))
+            if self._snapshot is None:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("No shared dataset published in %s within %ss, see the refresher "
+                                       "process log" % (self.dataset.path, self.wait_timeout))
+                time.sleep(0.5)
+        return self._snapshot
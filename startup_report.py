@@ -0,0 +1,74 @@
+"""
+Import-time report of the service entry points, checked against a startup budget.
+
+Imports each entry point in a fresh interpreter with -X importtime and prints the slowest top-level
+packages. The whole module body runs, so module-level work such as a network fetch counts against the
+budget as well; an import that has not finished after --timeout seconds fails the report. Exits with
+status 1 if an entry point needs more than the budget.
+
+    python startup_report.py abyss main --budget 1.0
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_times(module: str, timeout: float) -> list:
+    """ [(level, self seconds, cumulative seconds, module name), ...] of one -X importtime run """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module], capture_output=True,
+                            text=True, cwd=BASE_DIR, timeout=timeout)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((level, int(self_us) / 1e6, int(cumulative_us) / 1e6, name.strip()))
+    return entries
+
+
+def report(module: str, runs: int = 3, top: int = 10, timeout: float = 30):
+    """ (total import seconds, [(top-level package, seconds), ...] slowest first) of the fastest of `runs` runs """
+    best = None
+    for _ in range(runs):
+        entries = import_times(module, timeout)
+        total = sum(cumulative for level, _, cumulative, _ in entries if level == 0)
+        if best is None or total < best[0]:
+            best = (total, entries)
+    total, entries = best
+    # Self times summed per top-level package, so a package is counted wherever it is first imported from
+    packages = {}
+    for _, self_seconds, _, name in entries:
+        root = name.split(".")[0]
+        packages[root] = packages.get(root, 0) + self_seconds
+    return total, sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=["main", "abyss"], help="entry point modules")
+    parser.add_argument("--budget", type=float, default=float(os.getenv("STARTUP_BUDGET", 1.0)),
+                        help="maximum import time of each entry point in seconds")
+    parser.add_argument("--runs", type=int, default=3, help="report the fastest of this many runs")
+    parser.add_argument("--top", type=int, default=10, help="number of packages listed")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds after which an import run fails")
+    args = parser.parse_args()
+
+    over_budget = False
+    for module in args.modules:
+        total, packages = report(module, args.runs, args.top, args.timeout)
+        status = "OK" if total <= args.budget else "OVER BUDGET"
+        over_budget |= total > args.budget
+        print("%s: %.3fs of imports (budget %.3fs) %s" % (module, total, args.budget, status))
+        for package, seconds in packages:
+            print("  %-32s %.3fs" % (package, seconds))
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
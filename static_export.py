@@ -0,0 +1,190 @@
+"""
+Static front-end of the live dashboard.
+
+The page reads live.json, the index of the JSON files abyss.export_static publishes on every data refresh,
+and renders the figures and the data table in the browser, so a plain file server can serve the dashboard.
+"""
+from string import Template
+
+from artifacts import PLOTLY_JS_URL
+
+# live.json: {"version", "schedule", "updated_at", "floors", "languages", "num_bins", "defaults", "page_size",
+#             "files": {"names", "figures": {floor: {num_bins: file}}, "trends": {floor: file},
+#                       "tables": {language: file}}}
+INDEX_FILE = "live.json"
+PAGE_TEMPLATE = Template("""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>$title</title>
+<link rel="stylesheet" href="$stylesheet">
+</head>
+<body>
+<nav class="navbar navbar-dark bg-primary mb-3"><div class="container">
+<span class="navbar-brand">Spiral Abyss Live Report</span><small id="updated" class="text-white"></small>
+</div></nav>
+<div class="container">
+<div class="row">
+<div class="col-md-6 mb-3"><div class="card"><div class="card-header">Select Floor to Display Data</div>
+<div class="card-body" id="floors"></div></div></div>
+<div class="col-md-6 mb-3"><div class="card"><div class="card-header">Select Language</div>
+<div class="card-body"><select id="language" class="form-select"></select></div></div></div>
+</div>
+<div class="row">
+<div class="col-md-6 mb-3"><div class="card"><div class="card-header">Character Usage Data Diagram</div>
+<div class="card-body"><div id="usage_graph" style="height:450px"></div>
+<label for="num_bins">Set number of character display: <span id="num_bins_value"></span></label>
+<input type="range" id="num_bins" class="form-range"></div></div></div>
+<div class="col-md-6 mb-3"><div class="card"><div class="card-header">Full Data Table</div>
+<div class="card-body"><table class="table table-sm"><thead><tr id="table_head"></tr></thead>
+<tbody id="table_body"></tbody></table>
+<button id="previous_page" class="btn btn-sm btn-secondary">&lt;</button>
+<span id="page_label" class="mx-2"></span>
+<button id="next_page" class="btn btn-sm btn-secondary">&gt;</button></div></div></div>
+</div>
+<div class="card mb-3"><div class="card-header">Character Usage Trend</div>
+<div class="card-body"><div id="trend_graph" style="height:450px"></div></div></div>
+<div class="card mb-3"><div class="card-header">Uploader Information</div>
+<div class="card-body"><select id="uploader_region" class="form-select mb-2"></select>
+<iframe id="uploader_frame" width="90%" height="900" style="border:0"></iframe></div></div>
+</div>
+<script src="$plotly_js"></script>
+<script>
+const state = {floor: null, language: null, bins: null, page: 0};
+const documents = new Map();
+let live = null;
+
+async function getJSON(file, revalidate) {
+    if (!revalidate && documents.has(file)) {
+        return documents.get(file);
+    }
+    const response = await fetch(file, {cache: revalidate ? "no-cache" : "default"});
+    if (!response.ok) {
+        throw new Error(file + ": " + response.status);
+    }
+    const value = await response.json();
+    if (!revalidate) {
+        documents.set(file, value);
+    }
+    return value;
+}
+
+function percent(value) {
+    return value === null ? "" : (value * 100).toFixed(2) + "%";
+}
+
+async function drawUsage() {
+    const figure = await getJSON(live.files.figures[state.floor][state.bins]);
+    const lookup = (await getJSON(live.files.names))[state.language] || {};
+    // Same label switch as the dashboard's clientside callback: the x values are item IDs
+    const ids = figure.data[0].x;
+    const labels = ids.map(id => lookup[id] || id);
+    const layout = Object.assign({}, figure.layout, {
+        xaxis: Object.assign({}, figure.layout.xaxis, {tickvals: ids, ticktext: labels})
+    });
+    Plotly.react("usage_graph", [Object.assign({}, figure.data[0], {hovertext: labels})], layout, {responsive: true});
+}
+
+async function drawTrend() {
+    const figure = await getJSON(live.files.trends[state.floor]);
+    const lookup = (await getJSON(live.files.names))[state.language] || {};
+    // The trace names are item IDs, like the usage figure's x values
+    const data = figure.data.map(trace => Object.assign({}, trace, {name: lookup[trace.name] || trace.name}));
+    Plotly.react("trend_graph", data, figure.layout, {responsive: true});
+}
+
+async function drawTable() {
+    const table = await getJSON(live.files.tables[state.language]);
+    const order = table.orders[state.floor];
+    const pages = Math.max(1, Math.ceil(order.length / live.page_size));
+    state.page = Math.min(state.page, pages - 1);
+    const head = document.getElementById("table_head");
+    head.replaceChildren(...table.columns.map(column => {
+        const cell = document.createElement("th");
+        cell.textContent = column === state.language ? live.languages[column] : column;
+        return cell;
+    }));
+    const body = document.getElementById("table_body");
+    body.replaceChildren(...order.slice(state.page * live.page_size, (state.page + 1) * live.page_size).map(row => {
+        const line = document.createElement("tr");
+        table.rows[row].forEach((value, i) => {
+            const cell = document.createElement("td");
+            cell.textContent = i === 0 ? value : percent(value);
+            line.appendChild(cell);
+        });
+        return line;
+    }));
+    document.getElementById("page_label").textContent = (state.page + 1) + " / " + pages;
+}
+
+function draw() {
+    document.getElementById("num_bins_value").textContent = state.bins;
+    document.getElementById("updated").textContent =
+        "Schedule " + live.schedule + ", updated " + new Date(live.updated_at * 1000).toLocaleString();
+    return Promise.all([drawUsage(), drawTrend(), drawTable()]);
+}
+
+function buildControls() {
+    const floors = document.getElementById("floors");
+    floors.replaceChildren(...live.floors.map(floor => {
+        const label = document.createElement("label");
+        label.className = "form-check form-check-inline";
+        const input = document.createElement("input");
+        Object.assign(input, {type: "radio", name: "floor", value: floor, checked: floor === state.floor,
+                              className: "form-check-input"});
+        input.onchange = () => { state.floor = floor; state.page = 0; draw(); };
+        label.append(input, " " + floor);
+        return label;
+    }));
+    const language = document.getElementById("language");
+    language.replaceChildren(...Object.entries(live.languages).map(([code, name]) => new Option(name, code)));
+    language.value = state.language;
+    language.onchange = () => { state.language = language.value; draw(); };
+    const bins = document.getElementById("num_bins");
+    Object.assign(bins, {min: 0, max: live.num_bins.length - 1, step: 1, value: live.num_bins.indexOf(state.bins)});
+    bins.oninput = () => { state.bins = live.num_bins[bins.value]; draw(); };
+    document.getElementById("previous_page").onclick = () => { state.page = Math.max(0, state.page - 1); drawTable(); };
+    document.getElementById("next_page").onclick = () => { state.page += 1; drawTable(); };
+}
+
+async function loadUploaderRegions() {
+    const [regions, manifest] = await Promise.all([
+        getJSON("uploader_regions.json", true).catch(() => [{label: "All", file: "uploader_info.html"}]),
+        getJSON("manifest.json", true).catch(() => ({}))]);
+    const select = document.getElementById("uploader_region");
+    select.replaceChildren(...regions.map(region => new Option(region.label, manifest[region.file] || region.file)));
+    select.onchange = () => { document.getElementById("uploader_frame").src = select.value; };
+    select.onchange();
+}
+
+async function refresh() {
+    const next = await getJSON("$index_file", true);
+    if (live !== null && next.version === live.version) {
+        return;
+    }
+    const first = live === null;
+    live = next;
+    documents.clear();
+    if (first) {
+        state.floor = live.defaults.floor;
+        state.language = live.defaults.language;
+        state.bins = live.defaults.num_bins;
+        buildControls();
+    }
+    await draw();
+}
+
+refresh();
+loadUploaderRegions();
+setInterval(() => refresh().catch(console.error), 60000);
+</script>
+</body>
+</html>
+""")
+
+
+def page_html(title: str, stylesheet: str) -> bytes:
+    """ The static dashboard page, reading INDEX_FILE from its own directory """
+    return PAGE_TEMPLATE.substitute(title=title, stylesheet=stylesheet, plotly_js=PLOTLY_JS_URL,
+                                    index_file=INDEX_FILE).encode("utf-8")
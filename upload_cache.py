@@ -0,0 +1,108 @@
+import json
+import os
+import shutil
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+class UploadCache:
+    """
+    Local Parquet cache of processed upload rows (UID prefix, time, uploader).
+
+    The cache is a directory of Parquet part files plus a watermark file recording the highest
+    spiral_abysses primary key (and upload time) already stored, so each refresh only needs to
+    fetch rows newer than the watermark, and the keys below it still waiting for their records row.
+    """
+    WATERMARK_FILE = "watermark.json"
+
+    def __init__(self, path: str, max_parts: int = 32):
+        """
+        :param path: cache directory
+        :param max_parts: part files are compacted into one once there are more than this many
+        """
+        self.path = path
+        self.max_parts = max_parts
+
+    def _parts(self) -> list:
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(f for f in os.listdir(self.path) if f.endswith(".parquet"))
+
+    def _write_atomic(self, file_name: str, write):
+        tmp_path = os.path.join(self.path, "." + file_name + ".tmp")
+        write(tmp_path)
+        os.replace(tmp_path, os.path.join(self.path, file_name))
+
+    def load(self):
+        """
+        Read the cached rows and watermark.
+        Returns (None, None) if there is no usable cache, which callers treat as "rebuild from scratch".
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        watermark_path = os.path.join(self.path, self.WATERMARK_FILE)
+        if not os.path.exists(watermark_path):
+            return None, None
+        try:
+            with open(watermark_path, "r", encoding="utf-8") as f:
+                watermark = json.load(f)
+            # A part written after the last watermark update (e.g. interrupted run) holds rows
+            # that will be fetched again, so it is ignored to avoid duplicates
+            parts = [p for p in self._parts() if int(p[5:17]) <= watermark["PrimaryId"]]
+            if not parts:
+                return None, None
+            table = pa.concat_tables([pq.read_table(os.path.join(self.path, p)) for p in parts],
+                                   promote_options="default")
+        except (OSError, ValueError, KeyError, pa.ArrowException) as e:
+            print("Upload cache unreadable, rebuilding: " + str(e))
+            return None, None
+        return table.to_pandas(), watermark
+
+    def append(self, df: "pd.DataFrame", watermark: dict):
+        """ Store new rows as a part file, then advance the watermark """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        os.makedirs(self.path, exist_ok=True)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        # Rows read again below the watermark (see load_upload_frame's pending) do not advance it
+        file_name, count = "part-%012d.parquet" % watermark["PrimaryId"], 0
+        while os.path.exists(os.path.join(self.path, file_name)):
+            count += 1
+            file_name = "part-%012d-%d.parquet" % (watermark["PrimaryId"], count)
+        self._write_atomic(file_name, lambda tmp: pq.write_table(table, tmp, compression="zstd"))
+        self._write_watermark(watermark)
+        if len(self._parts()) > self.max_parts:
+            self.compact()
+
+    def replace(self, df: "pd.DataFrame", watermark: dict):
+        """ Drop the existing cache and store df as its only content """
+        self.clear()
+        self.append(df, watermark)
+
+    def compact(self):
+        """ Merge all part files into one """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        parts = self._parts()
+        if len(parts) <= 1:
+            return
+        table = pa.concat_tables([pq.read_table(os.path.join(self.path, p)) for p in parts],
+                                 promote_options="default")
+        merged = parts[-1]
+        self._write_atomic(merged, lambda tmp: pq.write_table(table, tmp, compression="zstd"))
+        for part in parts[:-1]:
+            os.remove(os.path.join(self.path, part))
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _write_watermark(self, watermark: dict):
+        def write(tmp):
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(watermark, f)
+        self._write_atomic(self.WATERMARK_FILE, write)
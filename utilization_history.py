@@ -0,0 +1,150 @@
+import os
+import threading
+import time
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+    import pyarrow as pa
+
+# Column name -> Arrow type of the stored snapshots
+HISTORY_COLUMNS = {
+    "schedule": "int32",
+    "floor": "int8",
+    "item": "int32",
+    "rate": "float32",
+    "fetched_at": "timestamp[s]",
+}
+
+
+def history_schema() -> "pa.Schema":
+    import pyarrow as pa
+
+    return pa.schema([(name, pa.type_for_alias(alias)) for name, alias in HISTORY_COLUMNS.items()])
+
+
+class UtilizationHistory:
+    """
+    Local store of every fetched Homa utilization snapshot, as Parquet files partitioned by schedule
+    (schedule=<id>/part-<fetch time>.parquet) and keyed by schedule, floor and item.
+
+    A snapshot identical to the last stored one of its schedule is not written again, and partitions
+    are compacted into a single file once they hold more than max_parts files.
+    """
+
+    def __init__(self, path: str, max_parts: int = 48):
+        self.path = path
+        self.max_parts = max_parts
+        self._last_written = {}
+        self._lock = threading.Lock()
+
+    def _partition(self, schedule: int) -> str:
+        return os.path.join(self.path, "schedule=%d" % schedule)
+
+    def _parts(self, schedule: int) -> list:
+        partition = self._partition(schedule)
+        if not os.path.isdir(partition):
+            return []
+        return sorted(f for f in os.listdir(partition) if f.endswith(".parquet"))
+
+    @staticmethod
+    def _rates(table: "pa.Table") -> "pd.Series":
+        df = table.select(["floor", "item", "rate"]).to_pandas()
+        return df.set_index(["floor", "item"])["rate"].sort_index()
+
+    def _latest_rates(self, schedule: int):
+        if schedule not in self._last_written:
+            import pyarrow.compute as pc
+            import pyarrow.parquet as pq
+
+            parts = self._parts(schedule)
+            if not parts:
+                return None
+            table = pq.read_table(os.path.join(self._partition(schedule), parts[-1]), schema=history_schema())
+            latest = table.filter(pc.equal(table["fetched_at"], pc.max(table["fetched_at"])))
+            self._last_written[schedule] = self._rates(latest)
+        return self._last_written[schedule]
+
+    def append(self, df: "pd.DataFrame", fetched_at: float = None) -> bool:
+        """
+        Store one utilization snapshot in the wide dashboard format
+        (item, schedule, "Floor 9" ... "Floor 12" columns); returns False if it was unchanged
+        """
+        import pandas as pd
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+
+        floors = [c for c in df.columns if c.startswith("Floor ")]
+        long_df = df.melt(id_vars=["item", "schedule"], value_vars=floors, var_name="floor", value_name="rate") \
+            .dropna(subset=["rate"])
+        long_df["floor"] = long_df["floor"].str.slice(start=6).astype("int8")
+        long_df["fetched_at"] = pd.Timestamp(fetched_at or time.time(), unit="s").floor("s")
+        table = pa.Table.from_pandas(long_df[list(HISTORY_COLUMNS)], schema=history_schema(), preserve_index=False)
+        written = False
+        with self._lock:
+            for schedule in long_df["schedule"].unique():
+                schedule = int(schedule)
+                part = table.filter(pc.equal(table["schedule"], schedule))
+                rates = self._rates(part)
+                previous = self._latest_rates(schedule)
+                if previous is not None and previous.round(6).equals(rates.round(6)):
+                    continue
+                partition = self._partition(schedule)
+                os.makedirs(partition, exist_ok=True)
+                file_name = "part-%d.parquet" % int(long_df["fetched_at"].iloc[0].timestamp())
+                tmp_path = os.path.join(partition, "." + file_name + ".tmp")
+                pq.write_table(part, tmp_path, compression="zstd")
+                os.replace(tmp_path, os.path.join(partition, file_name))
+                self._last_written[schedule] = rates
+                written = True
+                if len(self._parts(schedule)) > self.max_parts:
+                    self._compact(schedule)
+        return written
+
+    def _compact(self, schedule: int):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        partition = self._partition(schedule)
+        parts = self._parts(schedule)
+        schema = history_schema()
+        table = pa.concat_tables([pq.read_table(os.path.join(partition, p), schema=schema) for p in parts])
+        tmp_path = os.path.join(partition, "." + parts[-1] + ".tmp")
+        pq.write_table(table.sort_by([("fetched_at", "ascending")]), tmp_path, compression="zstd")
+        os.replace(tmp_path, os.path.join(partition, parts[-1]))
+        for part in parts[:-1]:
+            os.remove(os.path.join(partition, part))
+
+    def history(self, items: list = None, floor: int = None, schedule_from: int = None,
+                schedule_to: int = None) -> "pd.DataFrame":
+        """
+        All stored rates matching the filters, as a long (schedule, floor, item, rate, fetched_at) frame.
+        Schedule filters prune whole partitions; the others are pushed down into the Parquet scan.
+        """
+        import pandas as pd
+
+        if not os.path.isdir(self.path):
+            return pd.DataFrame(columns=list(HISTORY_COLUMNS))
+        import pyarrow.dataset as ds
+
+        dataset = ds.dataset(self.path, schema=history_schema(), format="parquet", partitioning="hive")
+        condition = None
+        for expression in (
+                ds.field("schedule") >= schedule_from if schedule_from is not None else None,
+                ds.field("schedule") <= schedule_to if schedule_to is not None else None,
+                ds.field("floor") == floor if floor is not None else None,
+                ds.field("item").isin(items) if items is not None else None):
+            if expression is not None:
+                condition = expression if condition is None else condition & expression
+        return dataset.to_table(filter=condition).to_pandas()
+
+    def trend(self, items: list, floor: int, schedule_from: int = None) -> "pd.DataFrame":
+        """ Last stored rate of each item per schedule: one row per schedule, one column per item """
+        import pandas as pd
+
+        df = self.history(items=items, floor=floor, schedule_from=schedule_from)
+        if df.empty:
+            return pd.DataFrame()
+        latest = df.sort_values("fetched_at").groupby(["schedule", "item"], observed=True).last()
+        return latest["rate"].unstack("item").sort_index()
@@ -0,0 +1,112 @@
+import os
+import signal
+import sys
+import time
+import traceback
+from typing import Callable
+
+from gunicorn.app.base import BaseApplication
+
+
+class WsgiServer(BaseApplication):
+    """
+    Gunicorn server whose WSGI app is built once in the master (preload), so the worker processes share
+    its memory copy-on-write. An optional sidecar function runs in one separate process, forked before
+    the app is built, restarted whenever it exits and stopped with the server, e.g. to produce the data
+    the workers read.
+    """
+
+    def __init__(self, app_factory: Callable[[], Callable], options: dict, sidecar: Callable[[], None] = None,
+                 restart_delay: float = 5, max_restart_delay: float = 300):
+        """
+        :param app_factory: function returning the WSGI app
+        :param options: gunicorn settings, e.g. {"bind": "0.0.0.0:8050", "workers": 4}
+        :param restart_delay: seconds before the sidecar is restarted after it exited; doubled after every
+            exit up to max_restart_delay, and reset once the sidecar ran for max_restart_delay seconds
+        """
+        self.app_factory = app_factory
+        self.options = dict(options, preload_app=True)
+        self.sidecar = sidecar
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self._sidecar_pid = None
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+        self.cfg.set("on_exit", self._stop_sidecar)
+
+    def load(self):
+        if self.sidecar is not None:
+            pid = os.fork()
+            if pid == 0:
+                self._supervise()
+            self._sidecar_pid = pid
+        return self.app_factory()
+
+    def _run_sidecar(self):
+        """ Body of the sidecar process: exits with status 1 and the traceback logged if the sidecar raises """
+        status = 0
+        try:
+            self.sidecar()
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else 1
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+    def _supervise(self):
+        """
+        Body of the supervisor process forked by the master: keeps one sidecar process running until SIGTERM
+        or until the master is gone. The master's own child handling reaps any process it forked, so the
+        sidecar is a child of this process instead.
+        """
+        master = os.getppid()
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        # Ctrl-C reaches the whole process group; the master stops the sidecar through on_exit instead
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        delay = self.restart_delay
+        child = None
+        while not stopping and os.getppid() == master:
+            started = time.monotonic()
+            child = os.fork()
+            if child == 0:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                self._run_sidecar()
+            status = None
+            while status is None and not stopping and os.getppid() == master:
+                pid, raw_status = os.waitpid(child, os.WNOHANG)
+                if pid:
+                    status = os.waitstatus_to_exitcode(raw_status)
+                else:
+                    time.sleep(1)
+            if status is None:
+                break
+            child = None
+            if time.monotonic() - started >= self.max_restart_delay:
+                delay = self.restart_delay
+            print("Sidecar exited with status %d, restarting in %.0fs" % (status, delay), flush=True)
+            deadline = time.monotonic() + delay
+            while not stopping and os.getppid() == master and time.monotonic() < deadline:
+                time.sleep(1)
+            delay = min(delay * 2, self.max_restart_delay)
+        if child is not None:
+            try:
+                os.kill(child, signal.SIGTERM)
+                os.waitpid(child, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        os._exit(0)
+
+    def _stop_sidecar(self, server):
+        if self._sidecar_pid is not None:
+            try:
+                os.kill(self._sidecar_pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass